@@ -4,37 +4,94 @@
 
 """Charm the application."""
 
+import collections
+import functools
+import hashlib
 import logging
-import os
+import re
+import subprocess
+import time
 import typing
+import urllib.request
 from pathlib import Path
-from typing import Dict, List, Optional, cast
+from typing import Deque, Dict, List, Optional, cast
 
 import ops
 import ops_tracing
 import yaml
 from charmlibs.interfaces.certificate_transfer import CertificateTransferRequires
-from charms.grafana_agent.v0.cos_agent import COSAgentProvider, charm_tracing_config
+from charms.grafana_agent.v0.cos_agent import charm_tracing_config
 from charms.operator_libs_linux.v2 import snap
 
+import exporter_config
+import snapd
+from cos_agent_provider import CachingCOSAgentProvider, ZlibCodec
+
 logger = logging.getLogger(__name__)
 
+SNAP_NAME = "prometheus-snmp-exporter"
 SNAP_CHANNEL = "0.24/stable"
+# Charm resource holding a snap to install instead of the one from the store
+SNAP_RESOURCE = "snap"
+# Bytes of the snap resource read at a time when hashing it
+RESOURCE_READ_SIZE = 1024 * 1024
 EXPORTER_PORT = 9116
 CA_CERT_PATH = Path("/etc/snmp-exporter/receive-ca-cert.crt")
+SNAP_DATA_DIR = Path("/var/snap/prometheus-snmp-exporter/current")
+CONFIG_DIR = SNAP_DATA_DIR / "snmp.d"
+# Candidate config files are validated here before they are swapped into CONFIG_DIR
+STAGING_DIR = SNAP_DATA_DIR / "snmp.d.staging"
+# The single config file written by charm revisions before CONFIG_DIR, replaced by it
+LEGACY_CONFIG_PATH = SNAP_DATA_DIR / "snmp.yml"
+# Number of config validation results remembered across hooks
+VALIDATION_CACHE_SIZE = 16
+# Exporter log lines of SNMP walks that timed out
+WALK_TIMEOUT_PATTERN = re.compile(r"walking target.*timeout", re.IGNORECASE)
+# Snap state reused by the next hooks, as long as snapd changed nothing in between
+SNAP_STATE_FILENAME = ".snap_state.json"
+SERVICE_OVERRIDE_PATH = Path(
+    "/etc/systemd/system/snap.prometheus-snmp-exporter.snmp-exporter.service.d/"
+    "10-snmp-config.conf"
+)
+
+
+def _file_sha256(path: Path) -> str:
+    """Return the content hash of a file, read a chunk at a time."""
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        while chunk := f.read(RESOURCE_READ_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
 class SNMPExporterCharm(ops.CharmBase):
     """Charm the application."""
 
+    _stored = ops.StoredState()
+
     def __init__(self, *args):
         super().__init__(*args)
-
-        self.snap = snap.SnapCache()["prometheus-snmp-exporter"]
-
-        self._cos_agent = COSAgentProvider(
+        # Content hashes of the auths and modules the exporter is running with
+        self._stored.set_default(config_digests={})
+        # Results of validating configs with the exporter, keyed by snap revision and content hash
+        self._stored.set_default(validated_configs={})
+        # Why the latest config_file was rejected by the exporter, if it was
+        self._stored.set_default(config_error="")
+        # Staged config waiting for a quiet period before it is applied, and when it last changed
+        self._stored.set_default(pending_digests={}, pending_since=0.0)
+        # Key of the config_file option value last staged, which needs no staging again
+        self._stored.set_default(config_file_key="")
+        # Content hash of the snap resource last sideloaded, if any
+        self._stored.set_default(snap_resource_digest="")
+
+        self._snap_cache = snapd.SnapCache(state_file=self.charm_dir / SNAP_STATE_FILENAME)
+
+        self._cos_agent = CachingCOSAgentProvider(
             charm=self,
-            scrape_configs=self.scrape_configs(),
+            scrape_configs=self.scrape_configs,
+            scrape_configs_inputs=self._scrape_configs_inputs,
+            # Much faster to (de)compress than LZMA, for grafana-agents supporting it
+            dashboard_codec=ZlibCodec(),
             refresh_events=[self.on.config_changed],
             tracing_protocols=["otlp_http"],
         )
@@ -42,8 +99,12 @@ class SNMPExporterCharm(ops.CharmBase):
         self._cert_transfer = CertificateTransferRequires(self, "receive-ca-cert")
 
         self.framework.observe(self.on.install, self.on_install)
+        self.framework.observe(self.on.upgrade_charm, self._on_upgrade_charm)
         self.framework.observe(self.on.start, self.on_start)
         self.framework.observe(self.on.config_changed, self.on_config_changed)
+        self.framework.observe(self.on.update_status, self.on_update_status)
+        self.framework.observe(self.framework.on.commit, self._on_commit)
+        self.framework.observe(self.on.find_walk_timeouts_action, self._on_find_walk_timeouts)
 
         self.framework.observe(
             self.on.cos_agent_relation_joined,  # pyright: ignore
@@ -64,9 +125,49 @@ class SNMPExporterCharm(ops.CharmBase):
 
         self._reconcile_charm_tracing()
 
+    @functools.cached_property
+    def snap(self) -> "snapd.Snap":
+        """The exporter snap.
+
+        Resolved on first use, so that hooks not touching the snap never look it up in the
+        store, which air-gapped units cannot reach.
+        """
+        return self._snap_cache[SNAP_NAME]
+
     def on_install(self, event: ops.InstallEvent):
         """Handle install event."""
-        self.snap.ensure(state=snap.SnapState.Latest, channel=SNAP_CHANNEL)
+        if not self._install_snap_resource():
+            self.snap.ensure(state=snap.SnapState.Latest, channel=SNAP_CHANNEL)
+
+    def _on_upgrade_charm(self, event: ops.UpgradeCharmEvent):
+        """Handle upgrade-charm event, which is also emitted when a resource is attached."""
+        # The new charm revision may lay the config out differently
+        self._stored.config_file_key = ""
+        self._install_snap_resource()
+
+    def _install_snap_resource(self) -> bool:
+        """Sideload the attached snap resource, unless it is the one last sideloaded.
+
+        Returns True if a snap resource is attached, False otherwise.
+        """
+        if not (resource := self._snap_resource()):
+            return False
+        digest = _file_sha256(resource)
+        if digest == self._stored.snap_resource_digest:
+            logger.debug("The %r resource is already installed", SNAP_RESOURCE)
+            return True
+        logger.info("Installing the exporter snap from the %r resource", SNAP_RESOURCE)
+        self.snap = snapd.install_local(str(resource), dangerous=True)
+        self._stored.snap_resource_digest = digest
+        return True
+
+    def _snap_resource(self) -> Optional[Path]:
+        """Return the path of the attached snap resource, if a non-empty one is attached."""
+        try:
+            path = self.model.resources.fetch(SNAP_RESOURCE)
+        except (ops.ModelError, NameError):
+            return None
+        return path if path.stat().st_size else None
 
     def on_start(self, event: ops.StartEvent):
         """Handle start event."""
@@ -80,60 +181,271 @@ class SNMPExporterCharm(ops.CharmBase):
 
     def on_config_changed(self, event: ops.ConfigChangedEvent):
         """Handle config changed event."""
+        config_file = cast(str, self.config["config_file"])
+        if not config_file or not self._snmp_config_valid:
+            # A staged config replaced by an invalid one, or by none, must not be applied later
+            self._stored.pending_digests = {}
+            self._stored.config_file_key = ""
+        elif self._config_file_key == self._stored.config_file_key:
+            logger.debug("SNMP config unchanged, not staging it again")
         # Handle file writing and service restart during config change
-        snmp_config = self.snmp_config
-        if snmp_config:
-            self._write_snmp_config_file(snmp_config=snmp_config)
+        elif self._write_snmp_config_file(config_file):
+            self._stored.config_file_key = self._config_file_key
 
         self.set_status()
 
-    @property
-    def snmp_config(self) -> Optional[Dict]:
-        """Return the SNMP config from the Juju config options, if any is present."""
-        if config_file := cast(str, self.config["config_file"]):
-            snmp_config = yaml.safe_load(config_file)
-            if not isinstance(snmp_config, Dict):
-                logger.error(
-                    f"Unable to set config from file. Use juju config {self.unit.name} config_file=@FILENAME"
-                )
-                return None
-            return snmp_config
+    def on_update_status(self, event: ops.UpdateStatusEvent):
+        """Handle update status event."""
+        self._apply_pending_snmp_config()
+        self.set_status()
 
-    def _write_snmp_config_file(self, snmp_config: dict) -> bool:
-        """Write the SNMP config file to the expected location and restart the service.
+    def _on_find_walk_timeouts(self, event: ops.ActionEvent):
+        """Report the most recent exporter log lines of SNMP walks that timed out.
 
-        Returns True if successful, False otherwise.
+        The logs are streamed, and only the latest `limit` matches are kept in memory.
         """
-        # Get the snap data directory using the revision
+        lines, limit = int(event.params["lines"]), int(event.params["limit"])
+        if lines < 1 or limit < 1:
+            event.fail("lines and limit must be positive")
+            return
+
+        timeouts: Deque[str] = collections.deque(maxlen=limit)
+        found = 0
         try:
-            revision = self.snap.revision
-            snap_data_path = f"/var/snap/prometheus-snmp-exporter/{revision}"
-            config_path = os.path.join(snap_data_path, "snmp.yml")
-        except (AttributeError, KeyError, TypeError) as e:
-            # Fallback to current symlink if snap revision is not available
-            logger.warning(f"Could not get snap revision: {e}. Using fallback path.")
-            config_path = "/var/snap/prometheus-snmp-exporter/current/snmp.yml"
+            for log in self.snap.iter_logs(["snmp-exporter"], num_lines=lines):
+                if WALK_TIMEOUT_PATTERN.search(log["message"]):
+                    found += 1
+                    timeouts.append(f"{log['timestamp']} {log['message']}")
+        except snap.SnapError as e:
+            event.fail(f"Failed to read the exporter logs: {e}")
+            return
+        event.set_results({"found": found, "timeouts": "\n".join(timeouts)})
+
+    def _on_commit(self, _event: ops.CommitEvent):
+        """Save the snap state for the next hooks."""
+        self._snap_cache.save_state()
 
+    @functools.cached_property
+    def _snmp_config_valid(self) -> bool:
+        """Check whether the SNMP config from the Juju config options can be used.
+
+        The config is streamed through the parser rather than loaded, so that it never has to be
+        held in memory as a whole. A config already staged by a previous hook is not parsed again.
+        """
+        if self._config_file_key == self._stored.config_file_key:
+            return True
+        config_file = cast(str, self.config["config_file"])
         try:
-            # Ensure the directory exists
-            os.makedirs(os.path.dirname(config_path), exist_ok=True)
+            for _ in exporter_config.iter_sections(exporter_config.open_decoded(config_file)):
+                pass
+        except (ValueError, yaml.YAMLError) as e:
+            logger.error(
+                f"Unable to set config from file: {e}. Use juju config {self.unit.name} config_file=@FILENAME"
+            )
+            return False
+        return True
 
-            with open(config_path, "w") as f:
-                yaml.dump(snmp_config, f)
-            logger.info(f"SNMP config file written to {config_path}")
+    @functools.cached_property
+    def _config_file_key(self) -> str:
+        """Identify the config_file option value, and the exporter revision it is staged for."""
+        digest = hashlib.sha256(cast(str, self.config["config_file"]).encode()).hexdigest()
+        return f"{self.snap.revision}:{digest}"
 
-            # Restart the snap service to pick up the new configuration
-            try:
-                self.snap.restart()
-                logger.info("SNMP exporter service restarted to load new configuration")
-            except (snap.SnapError, OSError, AttributeError) as e:
-                logger.warning(f"Failed to restart SNMP exporter service: {e}")
+    def _write_snmp_config_file(self, config_file: str) -> bool:
+        """Write the SNMP config files to the expected location and reload or restart the service.
+
+        Every auth and module is written to a file of its own, and the service is launched with
+        all of them. Compressed configs are decompressed as they are split, straight into those
+        files. The files are first written to STAGING_DIR and validated by the exporter; only a
+        valid config is swapped into CONFIG_DIR, so a bad config never replaces a working one.
+
+        Once the exporter runs with a config, changes to it are not applied right away: they are
+        applied on update-status, once the config has not changed for `config_apply_delay`
+        seconds. A burst of config changes thus costs a single reload or restart.
 
+        Returns True if successful, False otherwise.
+        """
+        pending_digests = {kind: dict(d) for kind, d in self._stored.pending_digests.items()}
+        if (digests := self._stage_snmp_config(config_file)) is None:
+            return False
+
+        running_digests = {kind: dict(d) for kind, d in self._stored.config_digests.items()}
+        if digests == running_digests:
+            return True
+        if running_digests and self._config_apply_delay:
+            self._stored.pending_digests = digests
+            if digests == pending_digests:
+                # Unrelated config changes do not restart the quiet period
+                return True
+            self._stored.pending_since = time.time()
+            logger.info(
+                "SNMP config change staged, applying it once the config has not changed for "
+                f"{self._config_apply_delay}s"
+            )
             return True
+        return self._apply_staged_snmp_config(digests)
+
+    @property
+    def _config_apply_delay(self) -> int:
+        """Seconds without config changes after which a staged config change is applied."""
+        return max(0, cast(int, self.config.get("config_apply_delay", 0)))
+
+    def _apply_pending_snmp_config(self):
+        """Apply the staged config change, if it has not changed during the quiet period."""
+        if not self._stored.pending_digests:
+            return
+        if time.time() - self._stored.pending_since < self._config_apply_delay:
+            logger.debug("SNMP config changed recently, not applying it yet")
+            return
+        digests = {kind: dict(d) for kind, d in self._stored.pending_digests.items()}
+        if self._apply_staged_snmp_config(digests):
+            self._stored.pending_digests = {}
+
+    def _stage_snmp_config(self, config_file: str) -> Optional[exporter_config.Digests]:
+        """Write the SNMP config files to STAGING_DIR and validate them.
+
+        Returns the digests of the staged config if it is valid, None otherwise.
+        """
+        # Whatever was staged before is being replaced
+        self._stored.pending_digests = {}
+        try:
+            _, digests = exporter_config.write_sections(
+                STAGING_DIR, exporter_config.iter_sections(exporter_config.open_decoded(config_file))
+            )
         except OSError as e:
+            logger.error(f"Failed to write SNMP config file: {e}")
+            return None
+
+        validated = self._stored.validated_configs
+        key = f"{self.snap.revision}:{exporter_config.config_digest(digests)}"
+        if key in validated:
+            error = validated[key]
+            logger.debug("SNMP config was already validated")
+        else:
+            try:
+                error = self._validate_config_files(STAGING_DIR)
+            except (OSError, subprocess.TimeoutExpired) as e:
+                logger.error(f"Failed to validate SNMP config: {e}")
+                return None
+            while len(validated) >= VALIDATION_CACHE_SIZE:
+                del validated[next(iter(validated))]
+            validated[key] = error
+
+        self._stored.config_error = error
+        if error:
+            logger.error(f"SNMP config rejected by the exporter, keeping the current one: {error}")
+            # Until config_file or the exporter changes, staging it again would change nothing
+            self._stored.config_file_key = self._config_file_key
+            return None
+        return digests
+
+    def _validate_config_files(self, directory: Path) -> str:
+        """Check the config files in `directory` with the exporter's dry-run mode.
+
+        Returns the exporter's error if the config is invalid, an empty string otherwise.
+        """
+        try:
+            subprocess.run(
+                [
+                    "snap",
+                    "run",
+                    "prometheus-snmp-exporter.snmp-exporter",
+                    "--dry-run",
+                    f"--config.file={directory}/*.yml",
+                ],
+                capture_output=True,
+                text=True,
+                check=True,
+                timeout=120,
+            )
+        except subprocess.CalledProcessError as e:
+            output = (e.stderr or e.stdout or "").strip().splitlines()
+            return output[-1] if output else f"exit code {e.returncode}"
+        return ""
+
+    def _apply_staged_snmp_config(self, digests: exporter_config.Digests) -> bool:
+        """Swap the staged SNMP config files into CONFIG_DIR and reload or restart the service.
+
+        The auths and modules are diffed against the config the exporter is already running
+        with, to decide whether the change needs nothing, a reload or a restart.
+
+        Returns True if successful, False otherwise.
+        """
+        previous_digests = {kind: dict(d) for kind, d in self._stored.config_digests.items()}
+        try:
+            changed = exporter_config.sync_files(STAGING_DIR, CONFIG_DIR)
+            override_changed = self._write_service_override()
+            if not previous_digests:
+                # The unit may have been upgraded from a revision writing a single config file
+                LEGACY_CONFIG_PATH.unlink(missing_ok=True)
+        except (OSError, subprocess.CalledProcessError) as e:
             logger.error(f"Failed to write SNMP config file: {e}")
             return False
 
+        diff = exporter_config.ConfigDiff.between(previous_digests, digests)
+        action = diff.action
+        if override_changed or not previous_digests:
+            action = exporter_config.ApplyAction.RESTART
+        elif changed and action is exporter_config.ApplyAction.NOOP:
+            # The files on disk drifted from what the charm last wrote
+            action = exporter_config.ApplyAction.RELOAD
+        logger.info(f"SNMP config: {diff.summary()}; {action.value} needed")
+
+        if self._apply_snmp_config(action):
+            self._stored.config_digests = digests
+        return True
+
+    def _apply_snmp_config(self, action: exporter_config.ApplyAction) -> bool:
+        """Make the exporter service pick up its config files.
+
+        Returns True if the service is now running with the config files, False otherwise.
+        """
+        if action is exporter_config.ApplyAction.NOOP:
+            return True
+
+        if action is exporter_config.ApplyAction.RELOAD:
+            request = urllib.request.Request(
+                f"http://localhost:{EXPORTER_PORT}/-/reload", method="POST"
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=30):
+                    pass
+                logger.info("SNMP exporter service reloaded to load new configuration")
+                return True
+            except OSError as e:
+                # urllib errors (including HTTP errors) are OSErrors
+                logger.warning(f"Failed to reload SNMP exporter service, restarting it: {e}")
+
+        # Restart the snap service to pick up the new configuration
+        try:
+            self.snap.restart()
+            logger.info("SNMP exporter service restarted to load new configuration")
+        except (snap.SnapError, OSError, AttributeError) as e:
+            logger.warning(f"Failed to restart SNMP exporter service: {e}")
+            return False
+        return True
+
+    def _write_service_override(self) -> bool:
+        """Make the exporter service load every file in CONFIG_DIR.
+
+        Returns True if the systemd override was (re)written, False if it was already in place.
+        """
+        override = "\n".join(
+            [
+                "[Service]",
+                "ExecStart=",
+                "ExecStart=/usr/bin/snap run prometheus-snmp-exporter.snmp-exporter"
+                f" --config.file={CONFIG_DIR}/*.yml",
+                "",
+            ]
+        )
+        if SERVICE_OVERRIDE_PATH.exists() and SERVICE_OVERRIDE_PATH.read_text() == override:
+            return False
+        SERVICE_OVERRIDE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        SERVICE_OVERRIDE_PATH.write_text(override)
+        subprocess.run(["systemctl", "daemon-reload"], check=True)
+        return True
+
     def set_status(self):
         """Calculate and set the unit status."""
         config_file = self.model.config.get("config_file", "")
@@ -155,22 +467,40 @@ class SNMPExporterCharm(ops.CharmBase):
             return
 
         # Validate config files if both are set (this also parses them)
-        if config_file and not self.snmp_config:
+        if config_file and not self._snmp_config_valid:
             self.unit.status = ops.BlockedStatus(
                 "Invalid configuration file. Check logs for details."
             )
             return
 
+        if config_file and self._stored.config_error:
+            self.unit.status = ops.BlockedStatus(
+                f"Invalid configuration file: {self._stored.config_error}"
+            )
+            return
+
         # Check service status
         if self.snap.services["snmp-exporter"]["active"] is False:
             self.unit.status = ops.MaintenanceStatus()
+        elif config_file and self._stored.pending_digests:
+            self.unit.status = ops.ActiveStatus(
+                "Config change pending, applied on update-status once settled"
+            )
         else:
             self.unit.status = ops.ActiveStatus()
 
+    def _scrape_configs_inputs(self):
+        """Return the config options the scrape configs are generated from."""
+        return [self.config["targets"], self.config["scrape_config_file"]]
+
     def scrape_configs(self) -> List[Dict]:
         """Return the scrape configs for the endpoints generated by the SNMP exporter and for the SNMP exporter itself."""
         if config_file := cast(str, self.config["scrape_config_file"]):
-            scrape_config = yaml.safe_load(config_file)
+            try:
+                scrape_config = yaml.safe_load(exporter_config.open_decoded(config_file))
+            except (ValueError, yaml.YAMLError) as e:
+                logger.error(f"Unable to decode scrape config: {e}")
+                scrape_config = None
             if not isinstance(scrape_config, Dict):
                 logger.error(
                     f"Unable to set scrape config from file. Use juju config {self.unit.name} scrape_config_file=@FILENAME"
@@ -0,0 +1,686 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""A cos-agent provider that only recomputes and rewrites the relation data that changed.
+
+`CachingCOSAgentProvider` extends the provider of the `cos_agent` charm library, which it uses
+as is: every write to the databag triggers a relation-changed on grafana-agent, and thus a full
+reconfiguration of the agent, and the SNMP exporter can have large scrape jobs, dashboards and
+rule files. So, on top of the library:
+
+- every part of the relation data is only recomputed when its inputs change, and only written
+  when it differs from what the databag already holds;
+- encoded dashboards are cached on disk, keyed by content hash;
+- rendered alert rules are memoized until the charm is upgraded;
+- dashboards can be encoded with a faster codec, and large scrape jobs published in chunks,
+  for requirers that advertise support for them.
+"""
+
+import abc
+import base64
+import dataclasses
+import hashlib
+import json
+import logging
+import lzma
+import os
+import zlib
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    ClassVar,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+import pydantic
+from charms.grafana_agent.v0.cos_agent import (
+    COSAgentProvider,
+    CosAgentProviderUnitData,
+    CosAgentRequirerUnitData,
+    DataValidationError,
+)
+from cosl import DashboardPath40UID, JujuTopology
+from cosl.rules import AlertRules, generic_alert_groups
+from ops.framework import StoredState
+from ops.model import Relation
+
+logger = logging.getLogger(__name__)
+
+# Where encoded dashboards are cached, relative to the charm directory
+DASHBOARD_CACHE_DIR = ".cos_agent_cache/dashboards"
+# Databag keys of the scrape job chunks, numbered from 0
+SCRAPE_JOBS_CHUNK_KEY = "scrape-jobs-{}"
+# Scrape jobs larger than this (serialized, in bytes) are published in chunks of at most this size
+DEFAULT_SCRAPE_JOBS_CHUNK_SIZE = 256 * 1024
+# Scrape job chunks hold about 1 / SCRAPE_JOBS_CHUNK_FILL of their maximum size on average, so
+# that few of them overflow
+SCRAPE_JOBS_CHUNK_FILL = 4
+
+
+def _digest(payload: str) -> str:
+    """Return the content hash of a serialized databag payload."""
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _fingerprint(*inputs: Any) -> str:
+    """Return a hash of the inputs some part of the relation data is computed from."""
+    return _digest(json.dumps(inputs, sort_keys=True, default=str))
+
+
+def _files_fingerprint(*dirs: Union[str, Path], recursive: bool = False) -> str:
+    """Return a hash of the paths, sizes and modification times of the files in `dirs`.
+
+    Stat-ing the files is much cheaper than loading them, and good enough to tell whether they
+    changed, e.g. on charm upgrade.
+    """
+    stats = []
+    for d in dirs:
+        paths = Path(d).rglob("*") if recursive else Path(d).glob("*")
+        for path in sorted(paths):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            stats.append((str(path), st.st_size, st.st_mtime_ns))
+    return _fingerprint(stats)
+
+
+def _read_cache(path: Path) -> Optional[str]:
+    """Return the content of a cache entry, or None if there is none."""
+    try:
+        return path.read_text()
+    except OSError:
+        return None
+
+
+def _write_cache(path: Path, content: str):
+    """Atomically write a cache entry. Caching is best effort, so failures are only logged."""
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        tmp_path.write_text(content)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.debug("Unable to cache %s: %s", path, e)
+
+
+def _prune_cache(cache_dir: Path, keep: Set[str]):
+    """Remove the cache entries that are not in `keep`."""
+    if not cache_dir.is_dir():
+        return
+    for path in cache_dir.iterdir():
+        if path.name not in keep:
+            try:
+                path.unlink()
+            except OSError as e:
+                logger.debug("Unable to remove stale cache entry %s: %s", path, e)
+
+
+def _is_chunk_boundary(key: str, size: int, chunk_size: int) -> bool:
+    """Whether a chunk of scrape jobs ends after the item with this key and serialized size.
+
+    About one in every `chunk_size / SCRAPE_JOBS_CHUNK_FILL` bytes ends a chunk, depending only
+    on the content of the item, so that boundaries do not move when items are inserted or
+    removed elsewhere.
+    """
+    value = int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "big")
+    return value < (1 << 64) * size * SCRAPE_JOBS_CHUNK_FILL // chunk_size
+
+
+class _ScrapeJobChunker:
+    """Packs scrape jobs, target by target, into chunks of at most `chunk_size` bytes."""
+
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+        self.chunks: List[str] = []
+        # The job fragments of the current chunk, and its (over-estimated) serialized size
+        self._fragments: List[Dict] = []
+        self._size = 2
+        # The fragment of the current job and the targets of its current static config, if they
+        # are in the current chunk
+        self._fragment: Optional[Dict] = None
+        self._targets: Optional[List[str]] = None
+
+    def add(self, job: Dict):
+        """Add a job, split between chunks by its targets if needed."""
+        if not job.get("static_configs"):
+            encoded = json.dumps(job)
+            self._reserve(len(encoded) + 2)
+            self._fragments.append(job)
+            self._size += len(encoded) + 2
+            self._end_chunk_after(encoded, len(encoded) + 2)
+            return
+
+        base = {key: value for key, value in job.items() if key != "static_configs"}
+        base_size = len(json.dumps({**base, "static_configs": []})) + 2
+        for static_config in job["static_configs"]:
+            rest = {key: value for key, value in static_config.items() if key != "targets"}
+            rest_size = len(json.dumps({**rest, "targets": []})) + 2
+            self._targets = None
+            targets = static_config.get("targets", [])
+            if not targets:
+                self._reserve(self._open_size(base_size, rest_size))
+                self._open(base, base_size, rest, rest_size)
+            for target in targets:
+                target_size = len(json.dumps(target)) + 2
+                self._reserve(self._open_size(base_size, rest_size) + target_size)
+                self._open(base, base_size, rest, rest_size).append(target)
+                self._size += target_size
+                self._end_chunk_after(f"{job.get('job_name')}\0{target}", target_size)
+        self._fragment = self._targets = None
+
+    def end_chunk(self):
+        """End the current chunk, if it holds anything."""
+        if self._fragments:
+            self.chunks.append(json.dumps(self._fragments))
+        self._fragments, self._size = [], 2
+        self._fragment = self._targets = None
+
+    def _reserve(self, size: int):
+        """End the current chunk if `size` more bytes do not fit in it."""
+        if self._fragments and self._size + size > self.chunk_size:
+            self.end_chunk()
+
+    def _end_chunk_after(self, key: str, size: int):
+        """End the current chunk if the item just added is a chunk boundary."""
+        if _is_chunk_boundary(key, size, self.chunk_size):
+            self.end_chunk()
+
+    def _open_size(self, base_size: int, rest_size: int) -> int:
+        """Return the size of the fragment and static config to open for the next target."""
+        return (base_size if self._fragment is None else 0) + (
+            rest_size if self._targets is None else 0
+        )
+
+    def _open(self, base: Dict, base_size: int, rest: Dict, rest_size: int) -> List[str]:
+        """Open a fragment of the current job and static config in this chunk, if needed.
+
+        Returns the targets of the static config in this chunk.
+        """
+        if self._fragment is None:
+            self._fragment = {**base, "static_configs": []}
+            self._fragments.append(self._fragment)
+            self._size += base_size
+        if self._targets is None:
+            self._targets = []
+            self._fragment["static_configs"].append({**rest, "targets": self._targets})
+            self._size += rest_size
+        return self._targets
+
+
+def _named_scrape_jobs(jobs: List[Dict]) -> List[Dict]:
+    """Return the scrape jobs, naming those without a name, to merge their fragments back by.
+
+    A job is named after the hash of its settings other than its targets, so that its name
+    does not depend on the other jobs, nor change with its targets.
+    """
+    names = {job["job_name"] for job in jobs if job.get("job_name")}
+    named: List[Dict] = []
+    for job in jobs:
+        if not job.get("job_name"):
+            settings = {key: value for key, value in job.items() if key != "static_configs"}
+            static_configs = [
+                {key: value for key, value in static_config.items() if key != "targets"}
+                for static_config in job.get("static_configs", [])
+            ]
+            name = base_name = f"unnamed-{_fingerprint(settings, static_configs)[:12]}"
+            suffix = 1
+            while name in names:
+                suffix += 1
+                name = f"{base_name}-{suffix}"
+            names.add(name)
+            job = {**job, "job_name": name}
+        named.append(job)
+    return named
+
+
+def chunk_scrape_jobs(jobs: List[Dict], chunk_size: int) -> List[str]:
+    """Return the serialized scrape jobs in chunks of at most `chunk_size` bytes.
+
+    Jobs are split between chunks by their targets: every chunk holds fragments of jobs, with
+    part of their static configs, which may themselves hold only part of their targets. Merging
+    the static configs of the fragments of a job gives the job back. A chunk is only larger than
+    `chunk_size` if a single target does not fit in it. Jobs without a name are given one, by
+    `_named_scrape_jobs`, to tell their fragments apart.
+
+    Chunks end after the targets picked by `_is_chunk_boundary`, or when the next target would
+    not fit. So adding or removing a target only changes the chunk it is in, unless that chunk
+    overflows, instead of shifting every following chunk.
+
+    Returns an empty list if the jobs fit in a single chunk.
+    """
+    if len(json.dumps(jobs)) <= chunk_size:
+        return []
+    chunker = _ScrapeJobChunker(chunk_size)
+    for job in _named_scrape_jobs(jobs):
+        chunker.add(job)
+    chunker.end_chunk()
+    return chunker.chunks
+
+
+def read_scrape_job_chunks(
+    databag: Mapping[str, str], manifest: List[str]
+) -> Optional[List[Dict]]:
+    """Reassemble the scrape jobs published in chunks, listed by their digest in `manifest`.
+
+    This is what a requirer supporting chunks does with them. Returns None if a chunk is
+    missing or does not match its digest.
+    """
+    jobs: Dict[str, Dict] = {}
+    for index, digest in enumerate(manifest):
+        raw = databag.get(SCRAPE_JOBS_CHUNK_KEY.format(index))
+        if raw is None or _digest(raw) != digest:
+            logger.warning("Scrape job chunk %s is missing or does not match its digest", index)
+            return None
+        for fragment in json.loads(raw):
+            # Chunked jobs all have unique names; merge the fragments of each job back together
+            name = fragment["job_name"]
+            if name not in jobs:
+                jobs[name] = fragment
+            else:
+                jobs[name].setdefault("static_configs", []).extend(
+                    fragment.get("static_configs", [])
+                )
+    return list(jobs.values())
+
+
+class DashboardCodec(abc.ABC):
+    """Encoding of the dashboards in the relation data.
+
+    The codec used for a payload is named in it, so that the codecs can evolve without breaking
+    existing deployments. Only a codec that the requirer advertises is used.
+    """
+
+    # Versioned name of the encoding, as sent over the relation
+    name: ClassVar[str]
+
+    @abc.abstractmethod
+    def encode(self, content: str) -> str:
+        """Encode a dashboard into a string that fits in a databag."""
+
+    @abc.abstractmethod
+    def decode(self, encoded: str) -> str:
+        """Decode a dashboard encoded with this codec."""
+
+
+@dataclasses.dataclass(frozen=True)
+class LZMACodec(DashboardCodec):
+    """Base64 encoded, LZMA compressed dashboards; the smallest, but slow to compress.
+
+    This is the encoding of the library (`LZMABase64`), which every requirer understands,
+    whatever the preset.
+    """
+
+    name: ClassVar[str] = "lzma-v1"
+    # 0 (fastest) to 9 (smallest), optionally or-ed with lzma.PRESET_EXTREME
+    preset: int = lzma.PRESET_DEFAULT
+
+    def encode(self, content: str) -> str:  # noqa: D102
+        return base64.b64encode(lzma.compress(content.encode(), preset=self.preset)).decode()
+
+    def decode(self, encoded: str) -> str:  # noqa: D102
+        return lzma.decompress(base64.b64decode(encoded)).decode()
+
+
+@dataclasses.dataclass(frozen=True)
+class ZlibCodec(DashboardCodec):
+    """Base64 encoded, zlib compressed dashboards; larger, but much faster to (de)compress."""
+
+    name: ClassVar[str] = "zlib-v1"
+    # 1 (fastest) to 9 (smallest)
+    level: int = 6
+
+    def encode(self, content: str) -> str:  # noqa: D102
+        return base64.b64encode(zlib.compress(content.encode(), self.level)).decode()
+
+    def decode(self, encoded: str) -> str:  # noqa: D102
+        return zlib.decompress(base64.b64decode(encoded)).decode()
+
+
+# Codec of requirers that do not negotiate one
+LEGACY_DASHBOARD_CODEC = LZMACodec()
+# The known codecs, by name
+DASHBOARD_CODECS: Dict[str, DashboardCodec] = {
+    codec.name: codec for codec in (LEGACY_DASHBOARD_CODEC, ZlibCodec())
+}
+
+
+class ProviderUnitData(CosAgentProviderUnitData):
+    """The provider unit data of the library, with the dashboard codec and scrape job chunks.
+
+    Requirers ignore the fields they do not know about.
+    """
+
+    # Name of the DashboardCodec the dashboards are encoded with. Requirers that do not know
+    # this field decode the dashboards with the legacy codec, which is named here too.
+    dashboard_codec: Optional[str] = None
+    # If set, metrics_scrape_jobs is empty and the jobs are published in chunks, under the
+    # SCRAPE_JOBS_CHUNK_KEY keys; this lists the digest of each chunk.
+    metrics_scrape_jobs_chunks: Optional[List[str]] = None
+
+
+class RequirerUnitData(CosAgentRequirerUnitData):
+    """The requirer unit data of the library, with what the requirer can decode."""
+
+    dashboard_codecs: Optional[List[str]] = pydantic.Field(
+        None,
+        description="Names of the dashboard codecs the requirer can decode.",
+    )
+    scrape_jobs_chunks: Optional[bool] = pydantic.Field(
+        None,
+        description="Whether the requirer can reassemble scrape jobs published in chunks.",
+    )
+
+
+class CachingCOSAgentProvider(COSAgentProvider):
+    """A `COSAgentProvider` only recomputing and rewriting the relation data that changed."""
+
+    # Fingerprints of the inputs of each part of the relation data, as last written per relation,
+    # and the rendered alert rules of the current charm revision
+    _stored = StoredState()
+
+    def __init__(
+        self,
+        *args: Any,
+        scrape_configs_inputs: Optional[Callable[[], Any]] = None,
+        dashboard_codec: Optional[DashboardCodec] = None,
+        scrape_jobs_chunk_size: int = DEFAULT_SCRAPE_JOBS_CHUNK_SIZE,
+        **kwargs: Any,
+    ):
+        """Create a CachingCOSAgentProvider instance.
+
+        Args:
+            args: the arguments of `COSAgentProvider`.
+            scrape_configs_inputs: A callable returning the (json serializable) inputs the
+                `scrape_configs` callable generates the configs from, e.g. some config options.
+                The scrape jobs are then only regenerated when these inputs change. Without
+                it, a `scrape_configs` callable is called on every refresh.
+            dashboard_codec: How to encode the dashboards, if the requirer supports it. Defaults
+                to LZMA, which gives the smallest databags; `ZlibCodec` is much faster.
+            scrape_jobs_chunk_size: If the requirer supports it, scrape jobs larger than this
+                many bytes are published in chunks of at most this size, each under a key of
+                its own, so that only the changed chunks are rewritten.
+            kwargs: the keyword arguments of `COSAgentProvider`.
+        """
+        super().__init__(*args, **kwargs)
+        self._scrape_configs_inputs = scrape_configs_inputs
+        self._dashboard_codec = dashboard_codec or LEGACY_DASHBOARD_CODEC
+        self._scrape_jobs_chunk_size = scrape_jobs_chunk_size
+        self._stored.set_default(fingerprints={}, alert_rules={})
+        self._topology: Optional[JujuTopology] = None
+
+        # Rule files only change along with the charm
+        self.framework.observe(self._charm.on.upgrade_charm, self._on_upgrade_charm)
+
+    def _on_upgrade_charm(self, _):
+        """Forget everything computed from the files of the previous charm revision."""
+        self._stored.alert_rules = {}
+        self._stored.fingerprints = {}
+
+    def _on_refresh(self, event):
+        """Update the relation data, recomputing and rewriting only what changed."""
+        relations = self._charm.model.relations[self._relation_name]
+        fingerprints = self._fingerprints()
+        # Parts computed during this refresh, shared by all relations, by part and fingerprint
+        computed: Dict[Tuple[str, Optional[str]], Any] = {}
+
+        for relation in relations:
+            # Before a principal is related to the grafana-agent subordinate, we'd get
+            # ModelError: ERROR cannot read relation settings: unit "zk/2": settings not found
+            # Add a guard to make sure it doesn't happen.
+            if relation.data and self._charm.unit in relation.data:
+                # Subordinate relations can communicate only over unit data.
+                codec = self._negotiated_dashboard_codec(relation)
+                relation_fingerprints = {
+                    **fingerprints,
+                    "dashboards": _fingerprint(fingerprints["dashboards"], repr(codec)),
+                }
+                try:
+                    parts = self._payload_parts(relation, relation_fingerprints, codec, computed)
+                    chunks = []
+                    if self._requirer_supports_chunks(relation):
+                        chunks = chunk_scrape_jobs(
+                            parts["metrics_scrape_jobs"], self._scrape_jobs_chunk_size
+                        )
+                    if chunks:
+                        parts["metrics_scrape_jobs"] = []
+                        parts["metrics_scrape_jobs_chunks"] = [_digest(c) for c in chunks]
+                    data = ProviderUnitData(
+                        **parts,
+                        dashboard_codec=codec.name,
+                        log_slots=self._log_slots,
+                        tracing_protocols=self._tracing_protocols,
+                    )
+                    self._write_scrape_job_chunks(relation, chunks)
+                    self._write_unit_data(relation, data.KEY, data.json())
+                except (
+                    pydantic.ValidationError,
+                    json.decoder.JSONDecodeError,
+                ) as e:
+                    logger.error("Invalid relation data provided: %s", e)
+                else:
+                    self._stored.fingerprints[str(relation.id)] = {
+                        part: fp for part, fp in relation_fingerprints.items() if fp
+                    }
+
+    def _fingerprints(self) -> Dict[str, Optional[str]]:
+        """Return the fingerprints of the inputs of each expensive part of the relation data.
+
+        A part without a fingerprint (None) has unknown inputs, and is always recomputed.
+        """
+        topology = self._juju_topology.identifier
+        if self._scrape_configs_inputs is not None:
+            scrape_configs_inputs = self._scrape_configs_inputs()
+        elif callable(self._scrape_configs):
+            scrape_configs_inputs = None
+        else:
+            scrape_configs_inputs = self._scrape_configs
+        scrape_jobs_fingerprint = (
+            None
+            if scrape_configs_inputs is None
+            else _fingerprint(self._charm.app.name, self._metrics_endpoints, scrape_configs_inputs)
+        )
+        return {
+            "metrics_alert_rules": _fingerprint(
+                topology, _files_fingerprint(self._metrics_rules, recursive=self._recursive)
+            ),
+            "log_alert_rules": _fingerprint(
+                topology, _files_fingerprint(self._logs_rules, recursive=self._recursive)
+            ),
+            "dashboards": _fingerprint(
+                self._charm.meta.name, _files_fingerprint(*self._dashboard_dirs)
+            ),
+            "metrics_scrape_jobs": scrape_jobs_fingerprint,
+        }
+
+    def _requirer_data(self, relation: Relation) -> Optional[RequirerUnitData]:
+        """Return what the requirer unit published in the relation, if it is valid."""
+        for unit in relation.units:
+            try:
+                return RequirerUnitData.load(relation.data[unit])
+            except (DataValidationError, KeyError):
+                continue
+        return None
+
+    def _negotiated_dashboard_codec(self, relation: Relation) -> DashboardCodec:
+        """Return the preferred dashboard codec if the requirer supports it, else the legacy."""
+        if self._dashboard_codec.name == LEGACY_DASHBOARD_CODEC.name:
+            return self._dashboard_codec
+        requirer_data = self._requirer_data(relation)
+        if requirer_data and self._dashboard_codec.name in (requirer_data.dashboard_codecs or ()):
+            return self._dashboard_codec
+        return LEGACY_DASHBOARD_CODEC
+
+    def _requirer_supports_chunks(self, relation: Relation) -> bool:
+        """Whether the requirer can reassemble scrape jobs published in chunks."""
+        requirer_data = self._requirer_data(relation)
+        return bool(requirer_data and requirer_data.scrape_jobs_chunks)
+
+    def _write_scrape_job_chunks(self, relation: Relation, chunks: List[str]):
+        """Write the scrape job chunks that changed, and remove the stale ones."""
+        unit_data = relation.data[self._charm.unit]
+        for index, chunk in enumerate(chunks):
+            self._write_unit_data(relation, SCRAPE_JOBS_CHUNK_KEY.format(index), chunk)
+        index = len(chunks)
+        while SCRAPE_JOBS_CHUNK_KEY.format(index) in unit_data:
+            del unit_data[SCRAPE_JOBS_CHUNK_KEY.format(index)]
+            index += 1
+
+    def _payload_parts(
+        self,
+        relation: Relation,
+        fingerprints: Dict[str, Optional[str]],
+        codec: DashboardCodec,
+        computed: Dict[Tuple[str, Optional[str]], Any],
+    ) -> Dict[str, Any]:
+        """Return the expensive parts of the relation data, only recomputing the changed ones.
+
+        Parts whose inputs did not change since they were last written to this relation are
+        taken from its databag as they are.
+        """
+        builders: Dict[str, Callable[[], Any]] = {
+            "metrics_alert_rules": lambda: self._metrics_alert_rules,
+            "log_alert_rules": lambda: self._log_alert_rules,
+            "dashboards": lambda: self._encoded_dashboards(codec),
+            "metrics_scrape_jobs": lambda: self._scrape_jobs,
+        }
+        previous = self._stored.fingerprints.get(str(relation.id), {})
+        try:
+            current = json.loads(
+                relation.data[self._charm.unit].get(CosAgentProviderUnitData.KEY) or "{}"
+            )
+        except json.JSONDecodeError:
+            current = {}
+
+        if current.get("metrics_scrape_jobs_chunks") is not None:
+            current["metrics_scrape_jobs"] = read_scrape_job_chunks(
+                relation.data[self._charm.unit], current["metrics_scrape_jobs_chunks"]
+            )
+        parts = {}
+        for part, build in builders.items():
+            fingerprint = fingerprints[part]
+            if fingerprint and previous.get(part) == fingerprint and current.get(part) is not None:
+                parts[part] = current[part]
+                continue
+            if (part, fingerprint) not in computed:
+                computed[part, fingerprint] = build()
+            parts[part] = computed[part, fingerprint]
+        return parts
+
+    def _write_unit_data(self, relation: Relation, key: str, payload: str):
+        """Write the payload to the unit databag, unless it is already there.
+
+        Every write triggers a relation-changed on the remote side, and thus a full
+        reconfiguration of the agent, so identical payloads are not written again.
+        """
+        unit_data = relation.data[self._charm.unit]
+        current = unit_data.get(key, "")
+        if current == payload:
+            logger.debug("%s data unchanged for relation %s, not updating it", key, relation.id)
+            return
+        unit_data[key] = payload
+
+    @property
+    def _juju_topology(self) -> JujuTopology:
+        """The topology of the charm, computed once."""
+        if self._topology is None:
+            self._topology = JujuTopology.from_charm(self._charm)
+        return self._topology
+
+    @property
+    def _metrics_alert_rules(self) -> Dict:
+        """Use (for now) the prometheus_scrape AlertRules to initialize this."""
+
+        def render() -> Dict:
+            alert_rules = AlertRules(query_type="promql", topology=self._juju_topology)
+            alert_rules.add_path(self._metrics_rules, recursive=self._recursive)
+            alert_rules.add(
+                generic_alert_groups.application_rules,
+                group_name_prefix=self._juju_topology.identifier,
+            )
+            return alert_rules.as_dict()
+
+        return self._memoized_alert_rules("promql", self._metrics_rules, render)
+
+    @property
+    def _log_alert_rules(self) -> Dict:
+        """Use (for now) the loki_push_api AlertRules to initialize this."""
+
+        def render() -> Dict:
+            alert_rules = AlertRules(query_type="logql", topology=self._juju_topology)
+            alert_rules.add_path(self._logs_rules, recursive=self._recursive)
+            return alert_rules.as_dict()
+
+        return self._memoized_alert_rules("logql", self._logs_rules, render)
+
+    def _memoized_alert_rules(
+        self, query_type: str, rules_dir: str, render: Callable[[], Dict]
+    ) -> Dict:
+        """Return the rendered alert rules, only loading the rule files once per charm revision.
+
+        The cache is cleared on upgrade-charm.
+        """
+        key = _fingerprint(query_type, rules_dir, self._recursive, self._juju_topology.identifier)
+        if (cached := self._stored.alert_rules.get(key)) is not None:
+            return json.loads(cached)
+        rules = render()
+        self._stored.alert_rules[key] = json.dumps(rules)
+        return rules
+
+    @property
+    def _dashboards(self) -> List[str]:
+        return self._encoded_dashboards(self._dashboard_codec)
+
+    def _encoded_dashboards(self, codec: DashboardCodec) -> List[str]:
+        """Return the dashboards, encoded with `codec`.
+
+        Every codec has a cache directory of its own, so that relations negotiating different
+        codecs do not evict each other's entries.
+        """
+        dashboards: List[str] = []
+        cache_dir = (
+            Path(self._charm.charm_dir)
+            / DASHBOARD_CACHE_DIR
+            / f"{codec.name}-{_digest(repr(codec))[:12]}"
+        )
+        cached: Set[str] = set()
+        for d in self._dashboard_dirs:
+            for path in Path(d).glob("*"):
+                content = path.read_bytes()
+                rel_path = str(
+                    path.relative_to(self._charm.charm_dir) if path.is_absolute() else path
+                )
+                # The encoded dashboard depends on the file, the charm name and the path
+                key = hashlib.sha256(
+                    b"\0".join([content, self._charm.meta.name.encode(), rel_path.encode()])
+                ).hexdigest()
+                cached.add(key)
+                if (encoded := _read_cache(cache_dir / key)) is None:
+                    encoded = self._encode_dashboard(content, rel_path, codec)
+                    _write_cache(cache_dir / key, encoded)
+                dashboards.append(encoded)
+        _prune_cache(cache_dir, cached)
+        return dashboards
+
+    def _encode_dashboard(self, content: bytes, rel_path: str, codec: DashboardCodec) -> str:
+        """Return the dashboard, with its uid and tags set, as compressed relation data."""
+        dashboard = json.loads(content)
+        # COSAgentProvider is somewhat analogous to GrafanaDashboardProvider. We need to overwrite
+        # the uid here because there is currently no other way to communicate the dashboard path
+        # separately. https://github.com/canonical/grafana-k8s-operator/pull/363
+        dashboard["uid"] = DashboardPath40UID.generate(self._charm.meta.name, rel_path)
+
+        # Add tags
+        tags: List[str] = dashboard.get("tags", [])
+        if not any(tag.startswith("charm: ") for tag in tags):
+            tags.append(f"charm: {self._charm.meta.name}")
+        dashboard["tags"] = tags
+
+        return codec.encode(json.dumps(dashboard))
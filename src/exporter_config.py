@@ -0,0 +1,406 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Helpers for laying out the SNMP exporter configuration on disk.
+
+The exporter accepts several `--config.file` flags and merges their contents. Instead of one
+monolithic `snmp.yml`, the charm writes every auth and every module to a file of its own, so that
+a config change only touches the files whose content actually changed.
+
+Config options holding files may be compressed, to keep large files small while they travel
+through the controller: a `gz:` or `xz:` prefix followed by the base64 encoded compressed file.
+"""
+
+import base64
+import dataclasses
+import enum
+import hashlib
+import io
+import json
+import lzma
+import os
+import re
+import zlib
+from pathlib import Path
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Set,
+    Tuple,
+    Union,
+)
+
+import yaml
+
+# Top-level keys of snmp.yml whose entries are split into one file each.
+SPLIT_SECTIONS = ("auths", "modules")
+# Kind given to any other top-level key; those are written verbatim, one file per key.
+BASE_SECTION = "base"
+
+# How the sections of each kind are called in change summaries: (noun, verb for changes)
+_SUMMARY_WORDING = {
+    "auths": ("auth", "rotated"),
+    "modules": ("module", "changed"),
+    BASE_SECTION: ("setting", "changed"),
+}
+
+# Content hashes of a config, as {kind: {name: digest}}
+Digests = Dict[str, Dict[str, str]]
+
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^A-Za-z0-9_.-]")
+
+# libyaml-based parser and emitter if PyYAML was built with it, several times faster
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+# Number of base64 characters decoded at a time
+_DECODE_CHUNK_SIZE = 64 * 1024
+
+# Most YAML events a section may expand to once its aliases are resolved
+_MAX_SECTION_EVENTS = 1_000_000
+
+# Incremental decompressors for the supported compression prefixes
+_DECOMPRESSORS: Dict[str, Callable[[], Any]] = {
+    "gz": lambda: zlib.decompressobj(wbits=zlib.MAX_WBITS | 16),
+    "xz": lzma.LZMADecompressor,
+}
+
+
+class Section(NamedTuple):
+    """A self-contained piece of the SNMP config, e.g. a single module."""
+
+    kind: str
+    name: str
+    content: str
+
+    @property
+    def filename(self) -> str:
+        """Return the name of the file this section is written to."""
+        safe_name = _UNSAFE_FILENAME_CHARS.sub("_", self.name)
+        if safe_name != self.name:
+            # Keep sanitised names from colliding, e.g. "a/b" and "a_b".
+            safe_name += "-" + hashlib.sha256(self.name.encode()).hexdigest()[:8]
+        return f"{self.kind}-{safe_name}.yml"
+
+    @property
+    def digest(self) -> str:
+        """Return the content hash of this section."""
+        return hashlib.sha256(self.content.encode()).hexdigest()
+
+
+class ApplyAction(enum.Enum):
+    """What the exporter service needs in order to pick up a config change."""
+
+    NOOP = "no-op"
+    RELOAD = "reload"
+    RESTART = "restart"
+
+
+@dataclasses.dataclass
+class ConfigDiff:
+    """Structural diff between two configs, at the level of single auths and modules."""
+
+    added: Dict[str, List[str]] = dataclasses.field(default_factory=dict)
+    removed: Dict[str, List[str]] = dataclasses.field(default_factory=dict)
+    changed: Dict[str, List[str]] = dataclasses.field(default_factory=dict)
+
+    @classmethod
+    def between(cls, old: Mapping[str, Mapping[str, str]], new: Mapping[str, Mapping[str, str]]):
+        """Compare the section digests of two configs."""
+        diff = cls()
+        for kind in sorted({*old, *new}):
+            old_digests, new_digests = old.get(kind, {}), new.get(kind, {})
+            if added := sorted(new_digests.keys() - old_digests.keys()):
+                diff.added[kind] = added
+            if removed := sorted(old_digests.keys() - new_digests.keys()):
+                diff.removed[kind] = removed
+            if changed := sorted(
+                name
+                for name in new_digests.keys() & old_digests.keys()
+                if new_digests[name] != old_digests[name]
+            ):
+                diff.changed[kind] = changed
+        return diff
+
+    def __bool__(self) -> bool:
+        """Whether anything changed."""
+        return bool(self.added or self.removed or self.changed)
+
+    @property
+    def action(self) -> ApplyAction:
+        """Return what the running exporter needs to pick up this diff.
+
+        Auths and modules are reloaded in place; anything else is unknown to the charm, so it
+        gets a full restart.
+        """
+        if not self:
+            return ApplyAction.NOOP
+        kinds = {*self.added, *self.removed, *self.changed}
+        if kinds <= set(SPLIT_SECTIONS):
+            return ApplyAction.RELOAD
+        return ApplyAction.RESTART
+
+    def summary(self) -> str:
+        """Summarise the diff, e.g. "3 modules changed, 1 auth rotated"."""
+        parts = []
+        for names_by_kind, verb in (
+            (self.changed, None),
+            (self.added, "added"),
+            (self.removed, "removed"),
+        ):
+            for kind, names in names_by_kind.items():
+                noun, change_verb = _SUMMARY_WORDING.get(kind, (kind, "changed"))
+                plural = "" if len(names) == 1 else "s"
+                parts.append(f"{len(names)} {noun}{plural} {verb or change_verb}")
+        return ", ".join(parts) or "no changes"
+
+
+def iter_decoded(value: str) -> Iterator[bytes]:
+    """Yield the content of a config option holding a file, decompressing it on the fly.
+
+    Values without a compression prefix are returned as they are. Concatenated xz streams and
+    gzip members, e.g. made with `cat a.gz b.gz`, are decompressed one after the other.
+
+    Raises:
+        ValueError: if the value is not valid base64 or not validly compressed.
+    """
+    prefix, _, payload = value.partition(":")
+    if prefix not in _DECOMPRESSORS:
+        yield value.encode()
+        return
+
+    decompressor = _DECOMPRESSORS[prefix]()
+    pending = ""
+    try:
+        for start in range(0, len(payload), _DECODE_CHUNK_SIZE):
+            # base64 tools wrap their output, so skip any whitespace
+            pending += "".join(payload[start : start + _DECODE_CHUNK_SIZE].split())
+            usable = len(pending) - len(pending) % 4
+            data = base64.b64decode(pending[:usable], validate=True)
+            pending = pending[usable:]
+            while data:
+                if decompressor.eof:
+                    # Anything but another stream is rejected by the new decompressor
+                    decompressor = _DECOMPRESSORS[prefix]()
+                yield decompressor.decompress(data)
+                data = decompressor.unused_data
+    except (zlib.error, lzma.LZMAError) as e:
+        raise ValueError(f"invalid {prefix} data: {e}") from e
+    if pending or not decompressor.eof:
+        raise ValueError(f"truncated {prefix} data")
+
+
+def open_decoded(value: str) -> IO[str]:
+    """Return a text stream over the content of a config option holding a file.
+
+    The content is decompressed as the stream is read, so it never has to be held in memory.
+    """
+    return io.TextIOWrapper(io.BufferedReader(_ChunkReader(iter_decoded(value))), encoding="utf-8")
+
+
+def iter_sections(stream: Union[str, IO[str]]) -> Iterator[Section]:
+    """Split an SNMP exporter config into sections, one per auth, module and other top-level key.
+
+    The document is walked as a stream of YAML events, so the parsed config never has to exist
+    in memory as a whole. Each section is written to a file of its own, so aliases are replaced
+    with the node they refer to, which may be in another section.
+
+    Raises:
+        ValueError: if the document is not a single mapping, or uses an undefined alias.
+        yaml.YAMLError: if the document is not valid YAML.
+    """
+    events = yaml.parse(stream, Loader=_YAML_LOADER)
+    # The nodes of the anchors seen so far, with their own aliases resolved
+    anchors: Dict[str, List[yaml.Event]] = {}
+    next(events)  # StreamStartEvent
+    if isinstance(next(events), yaml.StreamEndEvent):
+        return  # Empty document
+    if not isinstance(next(events), yaml.MappingStartEvent):
+        raise ValueError("the SNMP config must be a mapping")
+
+    while not isinstance(key := next(events), yaml.MappingEndEvent):
+        value = next(events)
+        if not isinstance(key, yaml.ScalarEvent):
+            raise ValueError("the SNMP config keys must be scalars")
+        if key.value in SPLIT_SECTIONS and isinstance(value, yaml.MappingStartEvent):
+            while not isinstance(entry := next(events), yaml.MappingEndEvent):
+                if not isinstance(entry, yaml.ScalarEvent):
+                    raise ValueError(f"the keys under {key.value!r} must be scalars")
+                node = _resolve_aliases(_collect_node(events, next(events)), anchors)
+                yield Section(key.value, entry.value, _emit([key], entry, node))
+        else:
+            node = _resolve_aliases(_collect_node(events, value), anchors)
+            yield Section(BASE_SECTION, key.value, _emit([], key, node))
+
+    next(events)  # DocumentEndEvent
+    if not isinstance(next(events), yaml.StreamEndEvent):
+        raise ValueError("the SNMP config must be a single YAML document")
+
+
+def write_sections(directory: Path, sections: Iterable[Section]) -> Tuple[List[str], Digests]:
+    """Write each section to its own file in `directory`, removing files of stale sections.
+
+    Files whose content hash already matches are left untouched.
+
+    Returns:
+        The names of the files that were written or removed, and the digests of all sections.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    changed: List[str] = []
+    digests: Digests = {}
+    wanted = set()
+    for section in sections:
+        digests.setdefault(section.kind, {})[section.name] = section.digest
+        wanted.add(section.filename)
+        if _write_if_changed(directory / section.filename, section.content.encode()):
+            changed.append(section.filename)
+    changed.extend(_remove_stale_files(directory, wanted))
+    return changed, digests
+
+
+def sync_files(source: Path, destination: Path) -> List[str]:
+    """Make the config files in `destination` match the ones in `source`.
+
+    Files whose content hash already matches are left untouched.
+
+    Returns:
+        The names of the files that were written or removed.
+    """
+    destination.mkdir(parents=True, exist_ok=True)
+    changed: List[str] = []
+    wanted = set()
+    for path in sorted(source.glob("*.yml")):
+        wanted.add(path.name)
+        if _write_if_changed(destination / path.name, path.read_bytes()):
+            changed.append(path.name)
+    changed.extend(_remove_stale_files(destination, wanted))
+    return changed
+
+
+def config_digest(digests: Digests) -> str:
+    """Return a single content hash for a whole config, given the digests of its sections."""
+    return hashlib.sha256(json.dumps(digests, sort_keys=True).encode()).hexdigest()
+
+
+def file_digest(path: Path) -> str:
+    """Return the content hash of a file, or an empty string if it does not exist."""
+    try:
+        return hashlib.sha256(path.read_bytes()).hexdigest()
+    except FileNotFoundError:
+        return ""
+
+
+def _write_if_changed(path: Path, content: bytes) -> bool:
+    """Atomically write a file, unless it already has this content. Return whether it changed."""
+    if file_digest(path) == hashlib.sha256(content).hexdigest():
+        return False
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_bytes(content)
+    os.replace(tmp_path, path)
+    return True
+
+
+def _remove_stale_files(directory: Path, wanted: Set[str]) -> List[str]:
+    """Remove the config files in `directory` that are not wanted. Return their names."""
+    stale = [path for path in sorted(directory.glob("*.yml")) if path.name not in wanted]
+    for path in stale:
+        path.unlink()
+    return [path.name for path in stale]
+
+
+class _ChunkReader(io.RawIOBase):
+    """Raw binary stream reading from an iterator of byte chunks."""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._buffer = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._buffer:
+            if (chunk := next(self._chunks, None)) is None:
+                return 0
+            self._buffer = chunk
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def _collect_node(events: Iterator[yaml.Event], first: yaml.Event) -> List[yaml.Event]:
+    """Return the events making up the node that starts with `first`."""
+    node = [first]
+    depth = int(isinstance(first, yaml.CollectionStartEvent))
+    while depth:
+        event = next(events)
+        node.append(event)
+        if isinstance(event, yaml.CollectionStartEvent):
+            depth += 1
+        elif isinstance(event, yaml.CollectionEndEvent):
+            depth -= 1
+    return node
+
+
+def _resolve_aliases(
+    node: List[yaml.Event], anchors: Dict[str, List[yaml.Event]]
+) -> List[yaml.Event]:
+    """Return the events of `node` with its aliases replaced by the nodes they refer to.
+
+    Anchors are dropped from the returned events, and the nodes they name are added to
+    `anchors`, for the aliases of the nodes that follow.
+
+    Raises:
+        ValueError: if an alias refers to no preceding anchor, or the node gets too large.
+    """
+    resolved: List[yaml.Event] = []
+    # The anchor of each collection being resolved, and where its events start
+    open_collections: List[Tuple[Union[str, None], int]] = []
+    for event in node:
+        if isinstance(event, yaml.AliasEvent):
+            if event.anchor not in anchors:
+                raise ValueError(f"undefined alias {event.anchor!r} in the SNMP config")
+            resolved.extend(anchors[event.anchor])
+        elif isinstance(event, yaml.ScalarEvent):
+            scalar = yaml.ScalarEvent(
+                None, event.tag, event.implicit, event.value, style=event.style
+            )
+            resolved.append(scalar)
+            if event.anchor is not None:
+                anchors[event.anchor] = [scalar]
+        elif isinstance(event, yaml.CollectionStartEvent):
+            open_collections.append((event.anchor, len(resolved)))
+            collection = type(event)(None, event.tag, event.implicit, flow_style=event.flow_style)
+            resolved.append(collection)
+        else:
+            resolved.append(event)
+            if isinstance(event, yaml.CollectionEndEvent):
+                anchor, start = open_collections.pop()
+                if anchor is not None:
+                    anchors[anchor] = resolved[start:]
+        if len(resolved) > _MAX_SECTION_EVENTS:
+            raise ValueError("the aliases of the SNMP config expand to too large a config")
+    return resolved
+
+
+def _emit(parents: List[yaml.ScalarEvent], key: yaml.ScalarEvent, node: List[yaml.Event]) -> str:
+    """Render `key: node`, nested under the `parents` keys, as a standalone YAML document."""
+    events: List[yaml.Event] = [yaml.StreamStartEvent(), yaml.DocumentStartEvent(), _mapping()]
+    for parent in parents:
+        events.extend([parent, _mapping()])
+    events.extend([key, *node])
+    events.extend(yaml.MappingEndEvent() for _ in range(len(parents) + 1))
+    events.extend([yaml.DocumentEndEvent(), yaml.StreamEndEvent()])
+    return yaml.emit(events, Dumper=_YAML_DUMPER)
+
+
+def _mapping() -> yaml.MappingStartEvent:
+    return yaml.MappingStartEvent(anchor=None, tag=None, implicit=True)
@@ -0,0 +1,1441 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Snap operations through the snapd REST API, on top of the `snap` charm library.
+
+The library shells out to the `snap` command for most operations, opens a connection to snapd
+for every request, and reads every installed and available snap as soon as a `SnapCache` is
+created. The classes here extend the library's, keeping their API:
+
+- `SnapdClient` reuses a keep-alive connection to snapd, waits for changes through the notices
+  long-poll API, and streams logs and snap uploads;
+- `Snap` performs every operation through the snapd API, and caches its apps and config;
+- `SnapCache` resolves snaps on demand, and can persist them across hooks;
+- `add`, `remove` and `ensure` batch several snaps into one snapd change per action, and
+  `install_local` streams the snap file to snapd.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import copy
+import http.client
+import io
+import json
+import logging
+import mmap
+import os
+import re
+import secrets
+import select
+import socket
+import sys
+import time
+import typing
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from typing import Any, Iterator, Literal, Mapping, NoReturn, TypedDict
+
+from charms.operator_libs_linux.v2 import snap
+from charms.operator_libs_linux.v2.snap import (
+    JSONAble,
+    JSONType,
+    SnapAPIError,
+    SnapError,
+    SnapNotFoundError,
+    SnapService,
+    SnapServiceDict,
+    SnapState,
+)
+
+logger = logging.getLogger(__name__)
+
+# The names of the snaps available in the store, one per line, as cached by snapd
+_SNAP_NAMES_PATH = "/var/cache/snapd/names"
+
+# Seconds for which the apps of a snap read from snapd are reused
+APPS_CACHE_TTL = 5.0
+
+# Errors of a pooled connection that snapd closed while it was idle
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+
+# Socket paths of snapd instances too old to serve the notices API
+_notices_unsupported: set[str] = set()
+
+# Longest a single notices long-poll may block, as a fraction of the request timeout
+_NOTICES_WAIT_FRACTION = 0.5
+
+# Bytes of a snap file read and sent at a time when sideloading it
+_UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Poll delays of snapd change waits without notices: exponential backoff, capped
+_POLL_DELAY_INITIAL = 0.1
+_POLL_DELAY_MAX = 1.0
+
+# The level of a logfmt log line, e.g. "level=warn"
+_LOG_LEVEL = re.compile(r"\blevel=\"?(\w+)")
+
+
+class SnapLogDict(TypedDict, total=True):
+    """A log record of a snap service, as returned by GET logs."""
+
+    timestamp: str
+    message: str
+    sid: str
+    pid: str
+
+
+def _describe_api_error(error: SnapAPIError | TimeoutError) -> str:
+    """Return the most helpful description of a failed snapd request."""
+    if isinstance(error, SnapAPIError):
+        message = error.body.get("message") if isinstance(error.body, Mapping) else None
+        return str(message or error.message or error.status)
+    return str(error)
+
+
+class _UnixSocketConnection(http.client.HTTPConnection):
+    """An HTTPConnection to a named Unix socket."""
+
+    def __init__(self, host: str, timeout: float, socket_path: str):
+        super().__init__(host, timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        """Connect to the Unix socket (instead of a TCP socket)."""
+        if not hasattr(socket, "AF_UNIX"):
+            raise NotImplementedError(f"Unix sockets not supported on {sys.platform}")
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+        self.sock.settimeout(self.timeout)
+
+
+# Keep-alive connections to snapd, by socket path, reused by all SnapdClients of this process
+_connection_pool: dict[str, _UnixSocketConnection] = {}
+
+
+def _pooled_connection(socket_path: str, timeout: float) -> _UnixSocketConnection:
+    """Return the keep-alive connection to the snapd socket, creating it if needed.
+
+    An idle connection is readable only if snapd closed it, in which case a new one is made.
+    """
+    connection = _connection_pool.get(socket_path)
+    if connection is not None and connection.sock is not None:
+        readable, _, _ = select.select([connection.sock], [], [], 0)
+        if readable:
+            _close_pooled_connection(socket_path)
+            connection = None
+    if connection is None:
+        connection = _connection_pool[socket_path] = _UnixSocketConnection(
+            "localhost", timeout=timeout, socket_path=socket_path
+        )
+    connection.timeout = timeout
+    if connection.sock is not None:
+        connection.sock.settimeout(timeout)
+    return connection
+
+
+def _close_pooled_connection(socket_path: str) -> None:
+    """Close and forget the keep-alive connection to the snapd socket, if any."""
+    connection = _connection_pool.pop(socket_path, None)
+    if connection is not None:
+        connection.close()
+
+
+class _BufferedResponse(io.BytesIO):
+    """A fully read HTTP response, so that its connection can serve the next request."""
+
+    def __init__(self, response: http.client.HTTPResponse):
+        super().__init__(response.read())
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+
+class SnapdClient(snap.SnapClient):
+    """A `SnapClient` reusing a keep-alive connection, and covering more of the snapd API.
+
+    Without a custom opener, requests go through a keep-alive connection to snapd, shared by
+    all clients of the process.
+    """
+
+    def __init__(
+        self,
+        socket_path: str = "/run/snapd.socket",
+        opener: urllib.request.OpenerDirector | None = None,
+        base_url: str = "http://localhost/v2/",
+        timeout: float = 30.0,
+    ):
+        self._pooled = opener is None
+        super().__init__(socket_path, opener, base_url, timeout)
+        self.socket_path = socket_path
+
+    def _wait(self, change_id: str, timeout: float = 300) -> JSONType | None:
+        """Wait for an async change to complete.
+
+        Between checks of the change, snapd's notices API is long-polled for updates of the
+        change. On snapd without notices, the change is polled with exponential backoff,
+        starting at 100 milliseconds as in snap clients.
+        """
+        deadline = time.time() + timeout
+        # Timestamp of the last update of the change seen through notices
+        after = ""
+        delay = _POLL_DELAY_INITIAL
+        while True:
+            if time.time() > deadline:
+                raise TimeoutError(f"timeout waiting for snap change {change_id}")
+            response = self._request("GET", f"changes/{change_id}")
+            response = typing.cast("dict[str, Any]", response)
+            status = response["status"]
+            if status == "Done":
+                return response.get("data")
+            if status == "Doing" or status == "Do":
+                remaining = deadline - time.time()
+                if self.socket_path not in _notices_unsupported:
+                    after = self._wait_change_notice(change_id, after, remaining)
+                    if self.socket_path not in _notices_unsupported:
+                        continue
+                time.sleep(max(min(delay, remaining), 0))
+                delay = min(delay * 2, _POLL_DELAY_MAX)
+                continue
+            if status == "Wait":
+                logger.warning("snap change %s succeeded with status 'Wait'", change_id)
+                return response.get("data")
+            raise SnapError(
+                f"snap change {response.get('kind')!r} id {change_id} failed with status {status}"
+            )
+
+    def _wait_change_notice(self, change_id: str, after: str, timeout: float) -> str:
+        """Block until snapd notes an update of the change after `after`, or for `timeout`.
+
+        Returns the timestamp of the latest update noted, to wait for the next one with.
+        """
+        wait = min(timeout, self.timeout * _NOTICES_WAIT_FRACTION)
+        query = {"types": "change-update", "keys": change_id, "timeout": f"{max(wait, 0):.3f}s"}
+        if after:
+            query["after"] = after
+        try:
+            notices = self._request("GET", "notices", query)
+        except SnapAPIError as e:
+            if e.code not in (400, 404):
+                raise
+            logger.debug("snapd does not support notices, polling changes instead")
+            _notices_unsupported.add(self.socket_path)
+            return after
+        # snapd returns notices in the order they were last repeated
+        notices = typing.cast("list[dict[str, str]]", notices or [])
+        return notices[-1]["last-repeated"] if notices else after
+
+    def _get_change_notices(self, after: str) -> list[dict[str, JSONType]] | None:
+        """Return the snapd changes updated after the `after` timestamp, as notices.
+
+        Returns None if snapd is too old to serve notices.
+        """
+        if self.socket_path in _notices_unsupported:
+            return None
+        try:
+            notices = self._request("GET", "notices", {"types": "change-update", "after": after})
+        except SnapAPIError as e:
+            if e.code not in (400, 404):
+                raise
+            _notices_unsupported.add(self.socket_path)
+            return None
+        return typing.cast("list[dict[str, JSONType]]", notices or [])
+
+    def _iter_logs(
+        self, names: list[str], num_lines: int | None, follow: bool
+    ) -> Iterator[SnapLogDict]:
+        """Yield log records of snap apps, read as a stream.
+
+        snapd sends the records as a JSON text sequence: each is an RS character, the record
+        and a newline. The stream gets a connection of its own, so that the pooled connection
+        stays available to other requests while it is read; while following, it never times
+        out.
+        """
+        query = {"names": ",".join(names), "n": str(-1 if num_lines is None else num_lines)}
+        if follow:
+            query["follow"] = "true"
+        url = urllib.parse.urlsplit(self.base_url)
+        target = f"{url.path}logs?{urllib.parse.urlencode(query)}"
+        connection = _UnixSocketConnection(
+            "localhost", timeout=self.timeout, socket_path=self.socket_path
+        )
+        try:
+            try:
+                connection.request("GET", target, headers={"Accept": "application/json-seq"})
+                response = connection.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                raise SnapAPIError({}, 500, "Not found", str(e)) from e
+            if follow and connection.sock is not None:
+                # New records may be a long time coming
+                connection.sock.settimeout(None)
+            if response.status >= 400:
+                try:
+                    body = json.loads(response.read().decode())["result"]  # json.loads -> Any
+                except (ValueError, KeyError):
+                    body = {}
+                raise SnapAPIError(body, response.status, response.reason, "")
+            for line in response:
+                record = line.strip(b"\x1e\r\n")
+                if record:
+                    yield json.loads(record)
+        finally:
+            connection.close()
+
+    def _post_snap_file(self, path: str, options: dict[str, str]) -> JSONType | None:
+        """Sideload a snap file and wait for the change to complete.
+
+        The file is streamed from disk as a multipart form upload, on a connection of its own,
+        so that it is never read into memory as a whole.
+        """
+        boundary = secrets.token_hex(16)
+        fields = "".join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+            for name, value in {"action": "install", **options}.items()
+        )
+        head = (
+            f"{fields}--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="snap"; filename="{os.path.basename(path)}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        tail = f"\r\n--{boundary}--\r\n".encode()
+
+        def body() -> Iterator[bytes]:
+            yield head
+            with open(path, "rb") as f:
+                while chunk := f.read(_UPLOAD_CHUNK_SIZE):
+                    yield chunk
+            yield tail
+
+        headers = {
+            "Accept": "application/json",
+            "Content-Type": f"multipart/form-data; boundary={boundary}",
+            "Content-Length": str(len(head) + os.path.getsize(path) + len(tail)),
+        }
+        url = urllib.parse.urlsplit(self.base_url)
+        connection = _UnixSocketConnection(
+            "localhost", timeout=self.timeout, socket_path=self.socket_path
+        )
+        try:
+            connection.request("POST", f"{url.path}snaps", body=body(), headers=headers)
+            response = _BufferedResponse(connection.getresponse())
+        except (OSError, http.client.HTTPException) as e:
+            raise SnapAPIError({}, 500, "Not found", str(e)) from e
+        finally:
+            connection.close()
+
+        if response.status >= 400:
+            try:
+                error = json.loads(response.read().decode())["result"]  # json.loads -> Any
+            except (ValueError, KeyError):
+                error = {}
+            raise SnapAPIError(error, response.status, response.reason, "")
+        result = json.loads(response.read().decode())  # json.loads -> Any
+        if result["type"] == "async":
+            return self._wait(result["change"])
+        return result["result"]
+
+    def _request_raw(
+        self,
+        method: str,
+        path: str,
+        query: dict[str, str] | None = None,
+        headers: dict[str, str] | None = None,
+        data: bytes | None = None,
+    ) -> http.client.HTTPResponse:
+        """Make a request to the Snapd server; return the raw HTTPResponse object."""
+        if not self._pooled:
+            return super()._request_raw(method, path, query, headers, data)
+        url = self.base_url + path
+        if query:
+            url = url + "?" + urllib.parse.urlencode(query)
+        return self._request_pooled(method, url, headers or {}, data)
+
+    def _request_pooled(
+        self, method: str, url: str, headers: dict[str, str], data: bytes | None
+    ) -> http.client.HTTPResponse:
+        """Make a request over the pooled keep-alive connection to snapd.
+
+        If snapd closed the connection while it was idle, the request is retried over a new
+        connection, unless snapd may have acted on it: when the connection is closed after the
+        request was sent, only GET requests are retried.
+        """
+        split_url = urllib.parse.urlsplit(url)
+        target = split_url.path + (f"?{split_url.query}" if split_url.query else "")
+        while True:
+            connection = _pooled_connection(self.socket_path, self.timeout)
+            reused = connection.sock is not None
+            sent = False
+            try:
+                connection.request(method, target, body=data, headers=headers)
+                sent = True
+                response = _BufferedResponse(connection.getresponse())
+            except _STALE_CONNECTION_ERRORS as e:
+                _close_pooled_connection(self.socket_path)
+                if reused and (not sent or method == "GET"):
+                    logger.debug("snapd closed the idle connection, reconnecting")
+                    continue
+                raise SnapAPIError({}, 500, "Not found", str(e)) from e
+            except (OSError, http.client.HTTPException) as e:
+                _close_pooled_connection(self.socket_path)
+                raise SnapAPIError({}, 500, "Not found", str(e)) from e
+            break
+
+        if response.status >= 400:
+            message = ""
+            body: dict[str, JSONType]
+            try:
+                body = json.loads(response.read().decode())["result"]  # json.loads -> Any
+            except (ValueError, KeyError) as e:
+                # Will only happen if snapd sends invalid JSON.
+                body = {}
+                message = f"{type(e).__name__} - {e}"
+            raise SnapAPIError(body, response.status, response.reason, message)
+        return typing.cast("http.client.HTTPResponse", response)
+
+    def get_installed_snap(self, name: str) -> dict[str, JSONType]:
+        """Get information about a single, currently installed snap."""
+        return self._request("GET", f"snaps/{name}")  # type: ignore
+
+    def _get_snap_conf(self, name: str) -> dict[str, JSONType]:
+        """Get the configuration details for an installed snap."""
+        return self._request("GET", f"snaps/{name}/conf")  # type: ignore
+
+    def _post_snap(self, name: str, action: str, options: dict[str, JSONAble]) -> None:
+        """Perform an action, e.g. install, on a snap and wait for the change to complete."""
+        self._request("POST", f"snaps/{name}", body={"action": action, **options})
+
+    def _post_snaps(self, action: str, names: list[str], options: dict[str, JSONAble]) -> None:
+        """Perform an action on several snaps at once and wait for the change to complete."""
+        self._request("POST", "snaps", body={"action": action, "snaps": names, **options})
+
+    def _post_apps(self, action: str, names: list[str], options: dict[str, JSONAble]) -> None:
+        """Start, stop or restart snap services and wait for the change to complete."""
+        self._request("POST", "apps", body={"action": action, "names": names, **options})
+
+    def _post_interfaces(
+        self, action: str, plugs: list[dict[str, str]], slots: list[dict[str, str]]
+    ) -> None:
+        """Connect or disconnect interfaces and wait for the change to complete."""
+        self._request(
+            "POST", "interfaces", body={"action": action, "plugs": plugs, "slots": slots}
+        )
+
+    def _post_aliases(self, action: str, snap: str, app: str, alias: str) -> None:
+        """Create or remove an alias and wait for the change to complete."""
+        self._request(
+            "POST", "aliases", body={"action": action, "snap": snap, "app": app, "alias": alias}
+        )
+
+
+class Snap(snap.Snap):
+    """A `Snap` performing every operation through the snapd API.
+
+    Only reading nested config values as strings still runs `snap get`, which renders them in
+    a format of its own.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        state: SnapState,
+        channel: str,
+        revision: str,
+        confinement: str,
+        apps: list[dict[str, JSONType]] | None = None,
+        cohort: str | None = None,
+    ) -> None:
+        super().__init__(name, state, channel, revision, confinement, apps, cohort)
+        self._client = self._snap_client = SnapdClient()
+        # Monotonic time at which self._apps was read from snapd, if it is fresh
+        self._apps_read_at: float | None = None
+        # The typed config of the snap as read from snapd, if it is fresh
+        self._conf: dict[str, JSONType] | None = None
+        # Config changes collected by an ongoing config_transaction
+        self._pending_conf: dict[str, JSONAble] | None = None
+
+    def _snap_action(self, action: str, options: dict[str, JSONAble] | None = None) -> None:
+        """Perform a snap operation through the snapd API, waiting for it to complete.
+
+        Args:
+          action: the action to perform, e.g. "install" or "refresh"
+          options: (optional) parameters of the action, commonly channel or confinement
+
+        Raises:
+          SnapError if there is a problem encountered
+        """
+        try:
+            self._client._post_snap(self._name, action, options or {})
+        except (SnapAPIError, TimeoutError) as e:
+            raise SnapError(
+                f"Snap: {self._name!r}; {action} failed: {_describe_api_error(e)}"
+            ) from e
+
+    def _snap_apps_action(
+        self,
+        action: str,
+        services: list[str] | None = None,
+        options: dict[str, JSONAble] | None = None,
+    ) -> None:
+        """Perform a snap app operation through the snapd API, waiting for it to complete.
+
+        Args:
+          action: the action to perform, one of "start", "stop" or "restart"
+          services: the snap services to perform it on (otherwise all)
+          options: (optional) parameters of the action, e.g. enable
+
+        Raises:
+          SnapError if there is a problem encountered
+        """
+        if services:
+            # an attempt to keep the action constrained to the snap instance's services
+            names = [f"{self._name}.{service}" for service in services]
+        else:
+            names = [self._name]
+
+        # Whatever the outcome, the state of the services changed or is unknown
+        self._apps_read_at = None
+        try:
+            self._client._post_apps(action, names, options or {})
+        except (SnapAPIError, TimeoutError) as e:
+            raise SnapError(
+                f"Could not {action} {names} for snap [{self._name}]: {_describe_api_error(e)}"
+            ) from e
+
+    @typing.overload
+    def get(self, key: None | Literal[""], *, typed: Literal[False] = False) -> NoReturn: ...
+    @typing.overload
+    def get(self, key: str, *, typed: Literal[False] = False) -> str: ...
+    @typing.overload
+    def get(self, key: None | Literal[""], *, typed: Literal[True]) -> dict[str, JSONType]: ...
+    @typing.overload
+    def get(self, key: str, *, typed: Literal[True]) -> JSONType: ...
+    def get(self, key: str | None, *, typed: bool = False) -> JSONType | str:
+        """Fetch snap configuration values.
+
+        The whole config is read from snapd once, and reused until it is changed through this
+        object.
+
+        Args:
+            key: the key to retrieve. Default to retrieve all values for typed=True.
+            typed: set to True to retrieve typed values (set with typed=True).
+                Default is to return a string.
+        """
+        if typed:
+            return copy.deepcopy(self._conf_value(key))
+
+        if not key:
+            raise TypeError("Key must be provided when typed=False")
+
+        # return a string
+        value = self._conf_value(key)
+        if isinstance(value, (dict, list)):
+            # `snap get` has its own rendering of nested values
+            return self._snap("get", [key]).strip()
+        return value if isinstance(value, str) else json.dumps(value)
+
+    def set(self, config: dict[str, JSONAble], *, typed: bool = False) -> None:
+        """Set a snap configuration value.
+
+        Args:
+           config: a dictionary containing keys and values specifying the config to set.
+           typed: set to True to convert all values in the config into typed values while
+                configuring the snap (set with typed=True). Default is not to convert.
+        """
+        if not typed:
+            config = {k: str(v) for k, v in config.items()}
+        self._put_conf(config)
+
+    def unset(self, key: str) -> str:
+        """Unset a snap configuration value.
+
+        Args:
+            key: the key to unset
+        """
+        self._put_conf({key: None})
+        return ""
+
+    @contextlib.contextmanager
+    def config_transaction(self) -> Iterator[None]:
+        """Collect the config changes made with `set` and `unset`, and apply them at once.
+
+        The snap's configure hook then runs once for all the changes, instead of once per call.
+        Reads within the transaction see the config as it was before it. If the block raises,
+        no change is applied. A nested transaction is part of the enclosing one.
+        """
+        if self._pending_conf is not None:
+            yield
+            return
+        self._pending_conf = {}
+        try:
+            yield
+            pending = self._pending_conf
+        finally:
+            self._pending_conf = None
+        if pending:
+            self._put_conf(pending)
+
+    def _conf_value(self, key: str | None) -> JSONType:
+        """Return the value of a (dotted) config key, or the whole config without a key.
+
+        Raises:
+          SnapError if the key is not set, or the config cannot be read
+        """
+        if self._conf is None:
+            try:
+                self._conf = self._client._get_snap_conf(self._name)
+            except SnapAPIError as e:
+                raise SnapError(
+                    f"Snap: {self._name!r}; could not get its config: {_describe_api_error(e)}"
+                ) from e
+        value: JSONType = self._conf
+        for part in key.split(".") if key else []:
+            if not isinstance(value, dict) or part not in value:
+                raise SnapError(f"Snap: {self._name!r}; no {key!r} configuration option")
+            value = value[part]
+        return value
+
+    def _put_conf(self, config: dict[str, JSONAble]) -> None:
+        """Apply config changes, or collect them for the ongoing config transaction."""
+        if self._pending_conf is not None:
+            self._pending_conf.update(config)
+            return
+        self._conf = None
+        self._client._put_snap_conf(self._name, config)
+
+    def start(self, services: list[str] | None = None, enable: bool = False) -> None:
+        """Start a snap's services.
+
+        Args:
+            services (list): (optional) list of individual snap services to start (otherwise all)
+            enable (bool): (optional) flag to enable snap services on start. Default `false`
+        """
+        self._snap_apps_action("start", services, {"enable": True} if enable else None)
+
+    def stop(self, services: list[str] | None = None, disable: bool = False) -> None:
+        """Stop a snap's services.
+
+        Args:
+            services (list): (optional) list of individual snap services to stop (otherwise all)
+            disable (bool): (optional) flag to disable snap services on stop. Default `False`
+        """
+        self._snap_apps_action("stop", services, {"disable": True} if disable else None)
+
+    def logs(self, services: list[str] | None = None, num_lines: int = 10) -> str:
+        """Fetch a snap services' logs.
+
+        Args:
+            services (list): (optional) list of individual snap services to show logs from
+                (otherwise all)
+            num_lines (int): (optional) integer number of log lines to return. Default `10`
+        """
+        return "".join(
+            f"{log['timestamp']} {log['sid']}[{log['pid']}]: {log['message']}\n"
+            for log in self.iter_logs(services, num_lines=num_lines or 10)
+        )
+
+    def iter_logs(
+        self,
+        services: list[str] | None = None,
+        num_lines: int | None = 10,
+        follow: bool = False,
+        level: str | None = None,
+    ) -> Iterator[SnapLogDict]:
+        """Yield a snap services' log records, as snapd streams them.
+
+        Records are read one at a time, so that any amount of logs can be scanned in constant
+        memory. Closing the generator closes its connection to snapd.
+
+        Args:
+            services: (optional) list of individual snap services to show logs from
+                (otherwise all)
+            num_lines: (optional) number of most recent log records to start with, or None for
+                all of them. Default `10`
+            follow: (optional) keep yielding new records as they are logged. Default `False`
+            level: (optional) only yield records logged with this logfmt level, e.g. "warn"
+
+        Raises:
+            SnapError if the logs cannot be read
+        """
+        if services:
+            names = [f"{self._name}.{service}" for service in services]
+        else:
+            names = [self._name]
+
+        try:
+            for log in self._client._iter_logs(names, num_lines, follow):
+                if level is not None:
+                    match = _LOG_LEVEL.search(log["message"])
+                    if match is None or match.group(1).lower() != level.lower():
+                        continue
+                yield log
+        except (
+            SnapAPIError,
+            OSError,
+            http.client.HTTPException,
+            ValueError,
+            KeyError,
+            TypeError,
+        ) as e:
+            # OSError: e.g. the stream timed out; HTTPException: it was cut short;
+            # ValueError, KeyError, TypeError: snapd sent something else than log records
+            message = _describe_api_error(e) if isinstance(e, SnapAPIError) else repr(e)
+            raise SnapError(
+                f"Could not read logs of {names} for snap [{self._name}]: {message}"
+            ) from e
+
+    def connect(self, plug: str, service: str | None = None, slot: str | None = None) -> None:
+        """Connect a plug to a slot.
+
+        Args:
+            plug (str): the plug to connect
+            service (str): (optional) the snap service name to plug into
+            slot (str): (optional) the snap service slot to plug in to
+
+        Raises:
+            SnapError if there is a problem encountered
+        """
+        # Same as `snap connect`: a slot without a colon names the snap providing it
+        slot_snap, slot_name = "", ""
+        if service and slot:
+            slot_snap, slot_name = service, slot
+        elif slot:
+            slot_snap, _, slot_name = slot.partition(":")
+
+        try:
+            self._client._post_interfaces(
+                "connect",
+                plugs=[{"snap": self._name, "plug": plug}],
+                slots=[{"snap": slot_snap, "slot": slot_name}],
+            )
+        except (SnapAPIError, TimeoutError) as e:
+            raise SnapError(
+                f"Could not connect {plug!r} for snap [{self._name}]: {_describe_api_error(e)}"
+            ) from e
+
+    def hold(self, duration: timedelta | None = None) -> None:
+        """Add a refresh hold to a snap.
+
+        Args:
+            duration: duration for the hold, or None (the default) to hold this snap indefinitely.
+        """
+        hold_str = "forever"
+        if duration is not None:
+            seconds = round(duration.total_seconds())
+            hold_str = (datetime.now(timezone.utc) + timedelta(seconds=seconds)).isoformat()
+        self._snap_action("hold", {"hold-level": "general", "time": hold_str})
+
+    def unhold(self) -> None:
+        """Remove the refresh hold of a snap."""
+        self._snap_action("unhold")
+
+    def alias(self, application: str, alias: str | None = None) -> None:
+        """Create an alias for a given application.
+
+        Args:
+            application: application to get an alias.
+            alias: (optional) name of the alias; if not provided, the application name is used.
+        """
+        if alias is None:
+            alias = application
+        try:
+            self._client._post_aliases("alias", self._name, application, alias)
+        except (SnapAPIError, TimeoutError) as e:
+            raise SnapError(
+                f"Snap: {self._name!r}; alias {alias!r} failed: {_describe_api_error(e)}"
+            ) from e
+
+    def restart(self, services: list[str] | None = None, reload: bool = False) -> None:
+        """Restarts a snap's services.
+
+        Args:
+            services (list): (optional) list of individual snap services to restart.
+                (otherwise all)
+            reload (bool): (optional) flag to use the service reload command, if available.
+                Default `False`
+        """
+        self._snap_apps_action("restart", services, {"reload": True} if reload else None)
+
+    def _install(
+        self,
+        channel: str = "",
+        cohort: str = "",
+        revision: str = "",
+    ) -> None:
+        """Add a snap to the system.
+
+        Args:
+          channel: the channel to install from
+          cohort: optional, the key of a cohort that this snap belongs to
+          revision: optional, the revision of the snap to install
+        """
+        cohort = cohort or self._cohort
+
+        options: dict[str, JSONAble] = {}
+        if self.confinement == "classic":
+            options["classic"] = True
+        if self.confinement == "devmode":
+            options["devmode"] = True
+        if channel:
+            options["channel"] = channel
+        if revision:
+            options["revision"] = revision
+        if cohort:
+            options["cohort-key"] = cohort
+
+        self._snap_action("install", options)
+
+    def _refresh(
+        self,
+        channel: str = "",
+        cohort: str = "",
+        revision: str = "",
+        devmode: bool = False,
+        leave_cohort: bool = False,
+    ) -> None:
+        """Refresh a snap.
+
+        Args:
+          channel: the channel to install from
+          cohort: optionally, specify a cohort.
+          revision: optionally, specify the revision of the snap to refresh
+          devmode: optionally, specify devmode confinement
+          leave_cohort: leave the current cohort.
+        """
+        options: dict[str, JSONAble] = {}
+        if channel:
+            options["channel"] = channel
+
+        if revision:
+            options["revision"] = revision
+
+        if devmode:
+            options["devmode"] = True
+
+        if not cohort:
+            cohort = self._cohort
+
+        if leave_cohort:
+            self._cohort = ""
+            options["leave-cohort"] = True
+        elif cohort:
+            options["cohort-key"] = cohort
+
+        self._snap_action("refresh", options)
+
+    def _remove(self) -> str:
+        """Remove a snap from the system."""
+        self._snap_action("remove")
+        return ""
+
+    def ensure(
+        self,
+        state: SnapState,
+        classic: bool = False,
+        devmode: bool = False,
+        channel: str | None = None,
+        cohort: str | None = None,
+        revision: str | None = None,
+    ):
+        """Ensure that a snap is in a given state.
+
+        See `snap.Snap.ensure`. The cached apps and config are dropped: the apps are read
+        again once the snap is in the given state.
+        """
+        self._apps_read_at = None
+        self._conf = None
+        super().ensure(state, classic, devmode, channel, cohort, revision)
+
+    def _update_snap_apps(self) -> None:
+        """Update a snap's apps after snap changes state."""
+        try:
+            self._apps = self._client.get_installed_snap_apps(self._name)
+            self._apps_read_at = time.monotonic()
+        except SnapAPIError:
+            logger.debug("Unable to retrieve snap apps for %s", self._name)
+            self._apps = []
+            self._apps_read_at = None
+
+    def get_apps(self, refresh: bool = False) -> list[dict[str, JSONType]]:
+        """Return (if any) the installed apps of the snap.
+
+        The apps are read from snapd at most every `APPS_CACHE_TTL` seconds, and after any
+        start, stop, restart or ensure through this object.
+
+        Args:
+            refresh: read the apps from snapd, even if they were read recently
+        """
+        read_at = self._apps_read_at
+        if refresh or read_at is None or time.monotonic() - read_at >= APPS_CACHE_TTL:
+            self._update_snap_apps()
+        return self._apps
+
+    def get_services(self, refresh: bool = False) -> dict[str, SnapServiceDict]:
+        """Return (if any) the installed services of the snap.
+
+        Args:
+            refresh: read the services from snapd, even if they were read recently
+        """
+        services: dict[str, SnapServiceDict] = {}
+        for app in self.get_apps(refresh=refresh):
+            if "daemon" in app:
+                app = typing.cast("dict[str, Any]", app)
+                services[app["name"]] = SnapService(**app).as_dict()
+
+        return services
+
+    @property
+    def apps(self) -> list[dict[str, JSONType]]:
+        """Returns (if any) the installed apps of the snap."""
+        return self.get_apps()
+
+    @property
+    def services(self) -> dict[str, SnapServiceDict]:
+        """Returns (if any) the installed services of the snap."""
+        return self.get_services()
+
+    @property
+    def held(self) -> bool:
+        """Report whether the snap has a hold."""
+        try:
+            info = self._client.get_installed_snap(self._name)
+        except SnapAPIError as e:
+            raise SnapError(
+                f"Snap: {self._name!r}; could not get its hold: {_describe_api_error(e)}"
+            ) from e
+        return "hold" in info
+
+
+class SnapCache(snap.SnapCache):
+    """A `SnapCache` resolving snaps on demand.
+
+    An installed snap is looked up through the `snapd` HTTP API, and the list of available snaps
+    on the filesystem is only scanned when asked about a snap that is not installed.
+    Information about available snaps is lazily-loaded from the `snapd` API when requested.
+
+    With a `state_file`, the installed snaps resolved so far can be persisted with `save_state`
+    and reused by the next `SnapCache`, e.g. in the next hook. The saved state is reused only
+    if snapd noted no change since it was read, which costs a single request, and for at most
+    `state_max_age` seconds, after which services may have stopped or started on their own.
+    """
+
+    def __init__(
+        self,
+        state_file: str | os.PathLike[str] | None = None,
+        state_max_age: float = 60.0,
+    ):
+        if not self.snapd_installed:
+            raise SnapError("snapd is not installed or not in /usr/bin") from None
+        self._client = self._snap_client = SnapdClient()
+        # The snaps resolved so far
+        self._snaps: dict[str, Snap] = {}
+        self._state_file = state_file
+        self._state_max_age = state_max_age
+        # When the snaps resolved so far started being read, in snapd's and in wall-clock time
+        self._state_since = datetime.now(timezone.utc).isoformat()
+        self._state_read_at = time.time()
+        if state_file is not None:
+            self._restore_state()
+
+    def __contains__(self, key: object) -> bool:
+        """Check if a given snap is in the cache."""
+        if not isinstance(key, str):
+            return False
+        return (
+            key in self._snaps
+            or self._load_installed_snap(key) is not None
+            or self._is_available(key)
+        )
+
+    def __len__(self) -> int:
+        """Report number of items in the snap cache."""
+        installed = self._installed_snaps()
+        return len(installed) + sum(
+            1 for name in self._iter_available_names() if name not in installed
+        )
+
+    def __iter__(self) -> Iterator[Snap | None]:  # pyright: ignore[reportIncompatibleMethodOverride]
+        """Provide iterator for the snap cache."""
+        installed = self._installed_snaps()
+        yield from installed.values()
+        for name in self._iter_available_names():
+            if name not in installed:
+                yield None
+
+    def __getitem__(self, snap_name: str) -> Snap:
+        """Return either the installed version or latest version for a given snap."""
+        snap = self._snaps.get(snap_name) or self._load_installed_snap(snap_name)
+        if snap is not None:
+            return snap
+        try:
+            snap = self._snaps[snap_name] = self._load_info(snap_name)
+        except SnapAPIError as e:
+            raise SnapNotFoundError(f"Snap '{snap_name}' not found!") from e
+        return snap
+
+    def save_state(self) -> None:
+        """Persist the installed snaps resolved so far to the state file, if there is one."""
+        if self._state_file is None:
+            return
+        snaps = {
+            name: {
+                "channel": snap.channel,
+                "revision": snap.revision,
+                "confinement": snap.confinement,
+                "cohort": snap._cohort,
+                # Only apps actually read from snapd are worth reusing
+                "apps": snap._apps if snap._apps_read_at is not None else None,
+            }
+            for name, snap in self._snaps.items()
+            if snap.present
+        }
+        state = {"since": self._state_since, "read-at": self._state_read_at, "snaps": snaps}
+        tmp_path = f"{os.fspath(self._state_file)}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self._state_file)
+        except OSError as e:
+            logger.debug("Unable to save snap state to %s: %s", self._state_file, e)
+
+    def _restore_state(self) -> None:
+        """Reuse the snaps of the state file, unless snapd changed them since they were read."""
+        assert self._state_file is not None
+        try:
+            with open(self._state_file) as f:
+                state = json.load(f)
+            since, read_at, snaps = state["since"], state["read-at"], state["snaps"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        if not 0 <= time.time() - read_at <= self._state_max_age:
+            logger.debug("Saved snap state expired, reloading it")
+            return
+        try:
+            notices = self._client._get_change_notices(after=since)
+        except SnapAPIError:
+            notices = None
+        if notices is None or notices:
+            logger.debug("snapd changed snaps since the saved snap state, reloading it")
+            return
+
+        for name, info in snaps.items():
+            snap = self._snaps[name] = Snap(
+                name=name,
+                state=SnapState.Latest,
+                channel=info["channel"],
+                revision=info["revision"],
+                confinement=info["confinement"],
+                apps=info["apps"],
+                cohort=info["cohort"],
+            )
+            if info["apps"] is not None:
+                snap._apps_read_at = time.monotonic()
+        self._state_since, self._state_read_at = since, read_at
+
+    def _iter_available_names(self) -> Iterator[str]:
+        """Yield the names of the available snaps from disk, one at a time."""
+        try:
+            with open(_SNAP_NAMES_PATH) as f:
+                for line in f:
+                    if line.strip():
+                        yield line.strip()
+        except FileNotFoundError:
+            # The snap catalog may not be populated yet; this is normal.
+            # snapd updates the cache infrequently and the cache file may not
+            # currently exist.
+            return
+
+    def _is_available(self, name: str) -> bool:
+        """Check whether a snap is in the list of available snaps on disk.
+
+        The file is memory-mapped and searched in place, so that it is never read into memory.
+        """
+        try:
+            with (
+                open(_SNAP_NAMES_PATH, "rb") as f,
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as names,
+            ):
+                line = name.encode() + b"\n"
+                return names[: len(line)] == line or names.find(b"\n" + line) != -1
+        except (FileNotFoundError, ValueError):
+            # ValueError: an empty file cannot be mapped
+            return False
+
+    def _load_installed_snap(self, name: str) -> Snap | None:
+        """Load a single installed snap into the dict, or return None if it is not installed.
+
+        Raises:
+            SnapAPIError if snapd fails to tell whether the snap is installed
+        """
+        try:
+            info = self._client.get_installed_snap(name)
+        except SnapAPIError as e:
+            if e.code == 404 or e.body.get("kind") == "snap-not-found":
+                return None
+            raise
+        snap = self._snaps[name] = _installed_snap(info)
+        return snap
+
+    def _installed_snaps(self) -> dict[str, Snap]:
+        """Load the installed snaps into the dict, and return them."""
+        installed: dict[str, Snap] = {}
+        for info in self._client.get_installed_snaps():
+            snap = _installed_snap(info)
+            installed[snap.name] = self._snaps[snap.name] = snap
+        return installed
+
+    def _load_info(self, name: str) -> Snap:
+        """Load info for snaps which are not installed if requested.
+
+        Args:
+            name: a string representing the name of the snap
+        """
+        info = typing.cast("dict[str, Any]", self._client.get_snap_information(name))
+
+        return Snap(
+            name=info["name"],
+            state=SnapState.Available,
+            channel=info["channel"],
+            revision=info["revision"],
+            confinement=info["confinement"],
+            apps=None,
+        )
+
+
+def _installed_snap(info: dict[str, JSONType]) -> Snap:
+    """Build the Snap of an installed snap from its snapd information."""
+    info = typing.cast("dict[str, Any]", info)
+    return Snap(
+        name=info["name"],
+        state=SnapState.Latest,
+        channel=info["channel"],
+        revision=info["revision"],
+        confinement=info["confinement"],
+        apps=info.get("apps"),
+    )
+
+
+# The SnapCache of the module functions, created on first use
+_cache: SnapCache | None = None
+
+
+def _snap_cache() -> SnapCache:
+    """Return the SnapCache of the module functions."""
+    global _cache
+    if _cache is None:
+        _cache = SnapCache()
+    return _cache
+
+
+@typing.overload
+def add(  # return a single Snap if snap name is given as a string
+    snap_names: str,
+    state: str | SnapState = SnapState.Latest,
+    channel: str | None = None,
+    classic: bool = False,
+    devmode: bool = False,
+    cohort: str | None = None,
+    revision: str | None = None,
+) -> Snap: ...
+@typing.overload
+def add(  # may return a single Snap or a list depending if one or more snap names were given
+    snap_names: list[str],
+    state: str | SnapState = SnapState.Latest,
+    channel: str | None = None,
+    classic: bool = False,
+    devmode: bool = False,
+    cohort: str | None = None,
+    revision: str | None = None,
+) -> Snap | list[Snap]: ...
+def add(
+    snap_names: str | list[str],
+    state: str | SnapState = SnapState.Latest,
+    channel: str | None = None,
+    classic: bool = False,
+    devmode: bool = False,
+    cohort: str | None = None,
+    revision: str | None = None,
+) -> Snap | list[Snap]:
+    """Add a snap to the system.
+
+    Args:
+        snap_names: the name or names of the snaps to install
+        state: a string or `SnapState` representation of the desired state, one of
+            [`Present` or `Latest`]
+        channel: an (Optional) channel as a string. Defaults to 'latest'
+        classic: an (Optional) boolean specifying whether it should be added with classic
+            confinement. Default `False`
+        devmode: an (Optional) boolean specifying whether it should be added with devmode
+            confinement. Default `False`
+        cohort: an (Optional) string specifying the snap cohort to use
+        revision: an (Optional) string specifying the snap revision to use
+
+    Several snaps without any channel, revision, cohort or confinement are installed or
+    refreshed together, in one snapd transaction each, following their default channel as
+    `snap install` does.
+
+    Raises:
+        SnapError if some snaps failed to install or were not found.
+    """
+    snap_names = [snap_names] if isinstance(snap_names, str) else snap_names
+    if not snap_names:
+        raise TypeError("Expected at least one snap to add, received zero!")
+
+    if isinstance(state, str):
+        state = SnapState(state)
+
+    return _wrap_snap_operations(
+        snap_names=snap_names,
+        state=state,
+        channel=channel or "",
+        classic=classic,
+        devmode=devmode,
+        cohort=cohort or "",
+        revision=revision or "",
+    )
+
+
+@typing.overload
+def remove(snap_names: str) -> Snap: ...
+# return a single Snap if snap name is given as a string
+@typing.overload
+def remove(snap_names: list[str]) -> Snap | list[Snap]: ...
+# may return a single Snap or a list depending if one or more snap names were given
+def remove(snap_names: str | list[str]) -> Snap | list[Snap]:
+    """Remove specified snap(s) from the system.
+
+    Args:
+        snap_names: the name or names of the snaps to install
+
+    Raises:
+        SnapError if some snaps failed to install.
+    """
+    snap_names = [snap_names] if isinstance(snap_names, str) else snap_names
+    if not snap_names:
+        raise TypeError("Expected at least one snap to add, received zero!")
+    return _wrap_snap_operations(
+        snap_names=snap_names,
+        state=SnapState.Absent,
+        channel="",
+        classic=False,
+        devmode=False,
+    )
+
+
+@typing.overload
+def ensure(  # return a single Snap if snap name is given as a string
+    snap_names: str,
+    state: str,
+    channel: str | None = None,
+    classic: bool = False,
+    devmode: bool = False,
+    cohort: str | None = None,
+    revision: int | None = None,
+) -> Snap: ...
+@typing.overload
+def ensure(  # may return a single Snap or a list depending if one or more snap names were given
+    snap_names: list[str],
+    state: str,
+    channel: str | None = None,
+    classic: bool = False,
+    devmode: bool = False,
+    cohort: str | None = None,
+    revision: int | None = None,
+) -> Snap | list[Snap]: ...
+def ensure(
+    snap_names: str | list[str],
+    state: str,
+    channel: str | None = None,
+    classic: bool = False,
+    devmode: bool = False,
+    cohort: str | None = None,
+    revision: int | None = None,
+) -> Snap | list[Snap]:
+    """Ensure specified snaps are in a given state on the system.
+
+    Args:
+        snap_names: the name(s) of the snaps to operate on
+        state: a string representation of the desired state, from `SnapState`
+        channel: an (Optional) channel as a string. Defaults to 'latest'
+        classic: an (Optional) boolean specifying whether it should be added with classic
+            confinement. Default `False`
+        devmode: an (Optional) boolean specifying whether it should be added with devmode
+            confinement. Default `False`
+        cohort: an (Optional) string specifying the snap cohort to use
+        revision: an (Optional) integer specifying the snap revision to use
+
+    When both channel and revision are specified, the underlying snap install/refresh
+    command will determine the precedence (revision at the time of adding this)
+
+    Raises:
+        SnapError if the snap is not in the cache.
+    """
+    if state in ("present", "latest") or revision:
+        return add(
+            snap_names=snap_names,
+            state=SnapState(state),
+            channel=channel,
+            classic=classic,
+            devmode=devmode,
+            cohort=cohort,
+            revision=str(revision) if revision is not None else None,
+        )
+    else:
+        return remove(snap_names)
+
+
+def _wrap_snap_operations(
+    snap_names: list[str],
+    state: SnapState,
+    channel: str,
+    classic: bool,
+    devmode: bool,
+    cohort: str = "",
+    revision: str = "",
+) -> Snap | list[Snap]:
+    """Wrap common operations for bare commands."""
+    snaps: list[Snap] = []
+    errors: list[str] = []
+
+    op = "remove" if state is SnapState.Absent else "install or refresh"
+
+    requested = list(snap_names)
+    batchable = not (channel or revision or cohort or classic or devmode)
+    if batchable and len(snap_names) > 1:
+        snap_names, snaps, errors = _batch_snap_operations(snap_names, state)
+    if not channel and not revision:
+        channel = "latest"
+
+    for s in snap_names:
+        try:
+            snap = _snap_cache()[s]
+            if state is SnapState.Absent:
+                snap.ensure(state=SnapState.Absent)
+            else:
+                snap.ensure(
+                    state=state,
+                    classic=classic,
+                    devmode=devmode,
+                    channel=channel,
+                    cohort=cohort,
+                    revision=revision,
+                )
+            snaps.append(snap)
+        except SnapError as e:  # noqa: PERF203
+            logger.warning("Failed to %s snap %s: %s!", op, s, e.message)
+            errors.append(s)
+        except SnapNotFoundError:
+            logger.warning("Snap '%s' not found in cache!", s)
+            errors.append(s)
+
+    if errors:
+        raise SnapError(f"Failed to install or refresh snap(s): {', '.join(errors)}")
+
+    # Batched and one by one operations complete in any order
+    snaps.sort(key=lambda snap: requested.index(snap.name))
+    return snaps if len(snaps) > 1 else snaps[0]
+
+
+def _batch_snap_operations(
+    snap_names: list[str], state: SnapState
+) -> tuple[list[str], list[Snap], list[str]]:
+    """Install, refresh or remove several snaps with one snapd change per action.
+
+    Install and refresh changes are transactional: if any snap fails, none is changed.
+
+    Returns:
+        The names of the snaps left to operate on one by one, e.g. because snapd is too old
+        for multi-snap operations; the snaps done; and the names of the snaps that failed.
+    """
+    snaps: list[Snap] = []
+    errors: list[str] = []
+    groups: dict[str, list[Snap]] = {"install": [], "refresh": [], "remove": []}
+    for s in snap_names:
+        try:
+            snap = _snap_cache()[s]
+        except SnapNotFoundError:
+            logger.warning("Snap '%s' not found in cache!", s)
+            errors.append(s)
+            continue
+        if state is not SnapState.Absent:
+            groups["refresh" if snap.present else "install"].append(snap)
+        elif snap.present:
+            groups["remove"].append(snap)
+        else:
+            # The snap is not installed -- no need to do anything.
+            snap._state = state
+            snaps.append(snap)
+
+    left: list[str] = []
+    client = SnapdClient()
+    for action, group in groups.items():
+        if not group:
+            continue
+        names = [snap.name for snap in group]
+        logger.info("Running snap %s of %s", action, ", ".join(names))
+        options: dict[str, JSONAble] = {} if action == "remove" else {"transaction": "all-snaps"}
+        try:
+            client._post_snaps(action, names, options)
+        except (SnapAPIError, SnapError, TimeoutError) as e:
+            message = e.message if isinstance(e, SnapError) else _describe_api_error(e)
+            if isinstance(e, SnapAPIError) and e.code == 400:
+                # e.g. snapd too old for this multi-snap operation
+                logger.debug("snapd refused a multi-snap %s: %s", action, message)
+                left.extend(names)
+            else:
+                logger.warning("Failed to %s snaps %s: %s", action, names, message)
+                errors.extend(names)
+            continue
+        for snap in group:
+            snap._state = state
+            snap._apps_read_at = None
+            snap._conf = None
+        snaps.extend(group)
+    return left, snaps, errors
+
+
+def install_local(
+    filename: str,
+    classic: bool = False,
+    devmode: bool = False,
+    dangerous: bool = False,
+) -> Snap:
+    """Install a local snap file.
+
+    The file is streamed to snapd, without being read into memory.
+
+    Args:
+        filename: the path to a local .snap file to install
+        classic: whether to use classic confinement
+        devmode: whether to use devmode confinement
+        dangerous: whether --dangerous should be passed to install snaps without a signature
+
+    Raises:
+        SnapError if there is a problem encountered
+    """
+    options: dict[str, str] = {}
+    if classic:
+        options["classic"] = "true"
+    if devmode:
+        options["devmode"] = "true"
+    if dangerous:
+        options["dangerous"] = "true"
+    try:
+        result = SnapdClient()._post_snap_file(filename, options)
+    except (SnapAPIError, TimeoutError, OSError) as e:
+        message = _describe_api_error(e) if isinstance(e, SnapAPIError) else e
+        raise SnapError(f"Could not install snap {filename}: {message}") from e
+    snap_name = typing.cast("dict[str, str]", result)["snap-name"]
+
+    c = SnapCache()
+
+    try:
+        return c[snap_name]
+    except (SnapAPIError, SnapNotFoundError) as e:
+        logger.error("Could not find snap %s when querying Snapd socket: %s", snap_name, e)
+        raise SnapError(f"Failed to find snap {snap_name} in Snap cache") from e
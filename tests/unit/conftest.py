@@ -7,6 +7,46 @@ from charm import SNMPExporterCharm
 
 
 @pytest.fixture
-def ctx():
-    with mock.patch("charms.operator_libs_linux.v2.snap.SnapCache"):
+def snap_cache():
+    """The (mocked) SnapCache class the charm looks its snap up with."""
+    with mock.patch("snapd.SnapCache") as snap_cache:
+        yield snap_cache
+
+
+@pytest.fixture
+def ctx(tmp_path, snap_cache):
+    with mock.patch.multiple(
+        "charm",
+        CONFIG_DIR=tmp_path / "snmp.d",
+        STAGING_DIR=tmp_path / "snmp.d.staging",
+        LEGACY_CONFIG_PATH=tmp_path / "snmp.yml",
+        SERVICE_OVERRIDE_PATH=tmp_path / "override.conf",
+    ), mock.patch("subprocess.run"), mock.patch("urllib.request.urlopen"):
         yield Context(SNMPExporterCharm)
+
+
+@pytest.fixture
+def config_dir(tmp_path):
+    return tmp_path / "snmp.d"
+
+
+@pytest.fixture
+def exporter_snap(snap_cache):
+    """The (mocked) snap the charm manages."""
+    return snap_cache.return_value.__getitem__.return_value
+
+
+@pytest.fixture
+def exporter_reload(ctx):
+    """The (mocked) request to reload the exporter config."""
+    import urllib.request
+
+    return urllib.request.urlopen
+
+
+@pytest.fixture
+def subprocess_run(ctx):
+    """The (mocked) subprocess.run, e.g. used to validate the exporter config."""
+    import subprocess
+
+    return subprocess.run
@@ -1,8 +1,20 @@
+import base64
+import dataclasses
+import gzip
 import json
+import lzma
+import subprocess
+import urllib.error
 from unittest import mock
 
+import pytest
 import yaml
-from ops.testing import Relation, State
+from ops.testing import ActiveStatus, BlockedStatus, Context, Relation, Resource, State
+
+import cos_agent_provider
+import exporter_config
+import snapd
+from charm import SNMPExporterCharm
 
 
 def test_status_no_config(ctx):
@@ -54,7 +66,7 @@ def test_status_with_config_file(ctx):
     # Mock file operations to prevent actual file writing
     with mock.patch("builtins.open", mock.mock_open()), mock.patch("yaml.dump"), mock.patch(
         "os.makedirs"
-    ), mock.patch("charms.operator_libs_linux.v2.snap.Snap.restart"):
+    ), mock.patch("snapd.Snap.restart"):
         state = State(
             config={
                 "targets": "",
@@ -170,7 +182,7 @@ def test_scrape_job_with_config(ctx):
     # Mock file operations to prevent actual file writing
     with mock.patch("builtins.open", mock.mock_open()), mock.patch("yaml.dump"), mock.patch(
         "os.makedirs"
-    ), mock.patch("charms.operator_libs_linux.v2.snap.Snap.restart"):
+    ), mock.patch("snapd.Snap.restart"):
         # Create a relation to get the scrape job configuration
         cos_agent_relation = Relation("cos-agent", remote_app_name="grafana-agent")
         state = State(
@@ -217,3 +229,659 @@ def test_cos_agent_relation_data_is_set(ctx):
 
     relation_data = json.loads(next(iter(state_out.relations)).local_unit_data["config"])
     assert len(relation_data["metrics_scrape_jobs"]) == 2
+
+
+def test_unchanged_cos_agent_relation_data_is_not_rewritten(ctx):
+    """Test that a refresh with an identical payload leaves the databag alone."""
+    cos_agent_relation = Relation("cos-agent", remote_app_name="grafana-agent")
+    state = State(relations=[cos_agent_relation], config={"targets": "1.2.3.4"})
+    state = ctx.run(ctx.on.relation_changed(cos_agent_relation), state=state)
+    payload = next(iter(state.relations)).local_unit_data["config"]
+
+    with mock.patch("ops.model.RelationDataContent.__setitem__") as setitem:
+        state = ctx.run(ctx.on.config_changed(), state=state)
+    setitem.assert_not_called()
+    assert next(iter(state.relations)).local_unit_data["config"] == payload
+
+    # A real change is still written
+    state = dataclasses.replace(state, config={"targets": "1.2.3.4,5.6.7.8"})
+    state = ctx.run(ctx.on.config_changed(), state=state)
+    assert next(iter(state.relations)).local_unit_data["config"] != payload
+
+
+def test_cos_agent_relation_data_is_only_recomputed_on_input_changes(ctx):
+    """Test that the relation data parts are only recomputed when their inputs change."""
+    cos_agent_relation = Relation("cos-agent", remote_app_name="grafana-agent")
+    state = State(relations=[cos_agent_relation], config={"targets": "1.2.3.4"})
+    state = ctx.run(ctx.on.relation_changed(cos_agent_relation), state=state)
+    payload = json.loads(next(iter(state.relations)).local_unit_data["config"])
+
+    with mock.patch.object(
+        cos_agent_provider, "AlertRules", wraps=cos_agent_provider.AlertRules
+    ) as alert_rules, mock.patch.object(
+        SNMPExporterCharm,
+        "scrape_configs",
+        autospec=True,
+        side_effect=SNMPExporterCharm.scrape_configs,
+    ) as scrape_configs:
+        # A config change unrelated to the relation data recomputes nothing
+        state = dataclasses.replace(
+            state, config={**state.config, "config_file": yaml.dump({"modules": {}})}
+        )
+        state = ctx.run(ctx.on.config_changed(), state=state)
+        alert_rules.assert_not_called()
+        scrape_configs.assert_not_called()
+        assert json.loads(next(iter(state.relations)).local_unit_data["config"]) == payload
+
+        # Changed targets only regenerate the scrape jobs
+        state = dataclasses.replace(state, config={**state.config, "targets": "5.6.7.8"})
+        state = ctx.run(ctx.on.config_changed(), state=state)
+        alert_rules.assert_not_called()
+        scrape_configs.assert_called_once()
+
+    relation_data = json.loads(next(iter(state.relations)).local_unit_data["config"])
+    assert relation_data["metrics_alert_rules"] == payload["metrics_alert_rules"]
+    targets = relation_data["metrics_scrape_jobs"][0]["static_configs"][0]["targets"]
+    assert targets == ["5.6.7.8"]
+
+
+def test_encoded_dashboards_are_cached(ctx, tmp_path, monkeypatch):
+    """Test that dashboards are only compressed again when their file changes."""
+    charm_root = tmp_path / "charm"
+    dashboard = charm_root / "src" / "grafana_dashboards" / "snmp.json"
+    dashboard.parent.mkdir(parents=True)
+    dashboard.write_text(json.dumps({"title": "SNMP", "panels": []}))
+    monkeypatch.chdir(charm_root)
+    ctx = Context(SNMPExporterCharm, charm_root=charm_root)
+    cos_agent_relation = Relation("cos-agent", remote_app_name="grafana-agent")
+
+    def dashboards() -> list:
+        state = State(relations=[cos_agent_relation], config={"targets": "1.2.3.4"})
+        state = ctx.run(ctx.on.relation_changed(cos_agent_relation), state=state)
+        return json.loads(next(iter(state.relations)).local_unit_data["config"])["dashboards"]
+
+    with mock.patch.object(
+        cos_agent_provider.LZMACodec,
+        "encode",
+        autospec=True,
+        side_effect=cos_agent_provider.LZMACodec.encode,
+    ) as compress:
+        encoded = dashboards()
+        compress.assert_called_once()
+        assert len(list((charm_root / cos_agent_provider.DASHBOARD_CACHE_DIR).glob("*/*"))) == 1
+
+        # Served from the cache
+        assert dashboards() == encoded
+        compress.assert_called_once()
+
+        # The file changed: encoded again, and the stale entry is dropped
+        dashboard.write_text(json.dumps({"title": "SNMP devices", "panels": []}))
+        assert dashboards() != encoded
+        assert compress.call_count == 2
+        assert len(list((charm_root / cos_agent_provider.DASHBOARD_CACHE_DIR).glob("*/*"))) == 1
+
+    decoded = json.loads(cos_agent_provider.LZMACodec().decode(encoded[0]))
+    assert decoded["uid"] == cos_agent_provider.DashboardPath40UID.generate(
+        "snmp-exporter", "src/grafana_dashboards/snmp.json"
+    )
+    assert "charm: snmp-exporter" in decoded["tags"]
+
+
+def test_dashboards_are_zlib_encoded_for_requirers_supporting_it(ctx):
+    """Test that the charm opts in to the faster dashboard codec."""
+    cos_agent_relation = Relation(
+        "cos-agent",
+        remote_app_name="grafana-agent",
+        remote_units_data={
+            0: {"receivers": "[]", "dashboard_codecs": json.dumps(["lzma-v1", "zlib-v1"])}
+        },
+    )
+    state = State(relations=[cos_agent_relation], config={"targets": "1.2.3.4"})
+    state = ctx.run(ctx.on.relation_changed(cos_agent_relation), state=state)
+
+    relation_data = json.loads(next(iter(state.relations)).local_unit_data["config"])
+    assert relation_data["dashboard_codec"] == cos_agent_provider.ZlibCodec.name
+
+
+def test_config_file_is_split_per_module(ctx, config_dir, exporter_snap):
+    """Test that auths and modules are written to separate files."""
+    config_dict = {
+        "auths": {"public_v2": {"community": "public", "version": 2}},
+        "modules": {
+            "if_mib": {"walk": ["1.3.6.1.2.1.2"]},
+            "system": {"walk": ["1.3.6.1.2.1.1"]},
+        },
+    }
+    state = State(
+        config={
+            "config_file": yaml.dump(config_dict),
+            "scrape_config_file": yaml.dump({"scrape_configs": []}),
+        }
+    )
+    ctx.run(ctx.on.config_changed(), state=state)
+
+    assert sorted(path.name for path in config_dir.iterdir()) == [
+        "auths-public_v2.yml",
+        "modules-if_mib.yml",
+        "modules-system.yml",
+    ]
+    merged = {}
+    for path in config_dir.iterdir():
+        for key, value in yaml.safe_load(path.read_text()).items():
+            merged.setdefault(key, {}).update(value)
+    assert merged == config_dict
+    exporter_snap.restart.assert_called_once()
+
+
+def test_unchanged_config_file_is_not_parsed_again(ctx, config_dir, exporter_snap):
+    """Test that config-changed for other options neither parses nor stages config_file."""
+    config_dict = {"modules": {"m1": {"walk": ["1.3.6.1.2.1.1"]}}}
+    state = State(
+        config={
+            "config_file": yaml.dump(config_dict),
+            "scrape_config_file": yaml.dump({"scrape_configs": []}),
+        }
+    )
+    with mock.patch.object(
+        exporter_config, "iter_sections", wraps=exporter_config.iter_sections
+    ) as iter_sections:
+        state = ctx.run(ctx.on.config_changed(), state=state)
+        assert iter_sections.call_count == 2
+
+        for delay in (60, 30):
+            state = dataclasses.replace(state, config={**state.config, "config_apply_delay": delay})
+            state = ctx.run(ctx.on.config_changed(), state=state)
+            assert state.unit_status.name == "active"
+        state = ctx.run(ctx.on.update_status(), state=state)
+        assert iter_sections.call_count == 2
+
+        config_dict["modules"]["m2"] = {"walk": ["1.3.6.1.2.1.2"]}
+        state = dataclasses.replace(
+            state,
+            config={**state.config, "config_file": yaml.dump(config_dict), "config_apply_delay": 0},
+        )
+        ctx.run(ctx.on.config_changed(), state=state)
+        assert iter_sections.call_count == 4
+    assert (config_dir / "modules-m2.yml").exists()
+    assert exporter_snap.restart.call_count == 1
+
+
+def test_aliases_across_sections_are_resolved(ctx, config_dir):
+    """Test that a section using an anchor of another section gets a file of its own."""
+    config_file = """
+auths:
+  public_v2: &public {community: public, version: 2}
+  public_v2_copy: *public
+modules:
+  system: &common
+    walk: [1.3.6.1.2.1.1]
+    retries: 3
+  if_mib:
+    <<: *common
+    walk: [1.3.6.1.2.1.2]
+"""
+    state = State(
+        config={
+            "config_file": config_file,
+            "scrape_config_file": yaml.dump({"scrape_configs": []}),
+        }
+    )
+    state_out = ctx.run(ctx.on.config_changed(), state=state)
+
+    assert state_out.unit_status.name == "active"
+    merged = {}
+    for path in config_dir.iterdir():
+        content = path.read_text()
+        assert "*" not in content and "&" not in content
+        for key, value in yaml.safe_load(content).items():
+            merged.setdefault(key, {}).update(value)
+    assert merged == yaml.safe_load(config_file)
+    assert merged["modules"]["if_mib"] == {"walk": ["1.3.6.1.2.1.2"], "retries": 3}
+
+
+def test_undefined_alias_blocks(ctx, config_dir):
+    """Test that a config_file using an undefined alias results in blocked status."""
+    state = State(
+        config={
+            "config_file": "modules:\n  system: *missing\n",
+            "scrape_config_file": yaml.dump({"scrape_configs": []}),
+        }
+    )
+    state_out = ctx.run(ctx.on.config_changed(), state=state)
+    assert state_out.unit_status.name == "blocked"
+    assert not config_dir.exists()
+
+
+def test_unchanged_config_files_are_not_rewritten(
+    ctx, config_dir, exporter_snap, exporter_reload
+):
+    """Test that only the changed module is rewritten, and that it is reloaded."""
+    config_dict = {
+        "auths": {"public_v2": {"community": "public", "version": 2}},
+        "modules": {
+            "if_mib": {"walk": ["1.3.6.1.2.1.2"]},
+            "system": {"walk": ["1.3.6.1.2.1.1"]},
+        },
+    }
+    scrape_config_yaml = yaml.dump({"scrape_configs": []})
+    state = State(
+        config={
+            "config_file": yaml.dump(config_dict),
+            "scrape_config_file": scrape_config_yaml,
+            "config_apply_delay": 0,
+        }
+    )
+    state = ctx.run(ctx.on.config_changed(), state=state)
+    mtimes = {path.name: path.stat().st_mtime_ns for path in config_dir.iterdir()}
+    # The first config is applied with a restart
+    exporter_snap.restart.assert_called_once()
+    exporter_reload.assert_not_called()
+
+    # Same config again: nothing is written and the service is left alone
+    exporter_snap.restart.reset_mock()
+    state = ctx.run(ctx.on.config_changed(), state=state)
+    assert {path.name: path.stat().st_mtime_ns for path in config_dir.iterdir()} == mtimes
+    exporter_snap.restart.assert_not_called()
+    exporter_reload.assert_not_called()
+
+    # One module changed, one removed: only those files are touched, and the config is reloaded
+    config_dict["modules"]["if_mib"]["walk"].append("1.3.6.1.2.1.31")
+    del config_dict["modules"]["system"]
+    state = dataclasses.replace(
+        state, config={**state.config, "config_file": yaml.dump(config_dict)}
+    )
+    ctx.run(ctx.on.config_changed(), state=state)
+    assert sorted(path.name for path in config_dir.iterdir()) == [
+        "auths-public_v2.yml",
+        "modules-if_mib.yml",
+    ]
+    assert (config_dir / "auths-public_v2.yml").stat().st_mtime_ns == mtimes[
+        "auths-public_v2.yml"
+    ]
+    assert (config_dir / "modules-if_mib.yml").stat().st_mtime_ns != mtimes["modules-if_mib.yml"]
+    exporter_snap.restart.assert_not_called()
+    exporter_reload.assert_called_once()
+
+
+def test_config_diff_is_summarised(ctx, caplog):
+    """Test that the config change is logged as a per-auth and per-module summary."""
+    config_dict = {
+        "auths": {"a": {"community": "a"}, "b": {"community": "b"}},
+        "modules": {name: {"walk": ["1.3.6.1.2.1.1"]} for name in ("m1", "m2", "m3", "m4")},
+    }
+    state = State(
+        config={
+            "config_file": yaml.dump(config_dict),
+            "scrape_config_file": yaml.dump({"scrape_configs": []}),
+            "config_apply_delay": 0,
+        }
+    )
+    state = ctx.run(ctx.on.config_changed(), state=state)
+
+    config_dict["auths"]["a"]["community"] = "rotated"
+    for name in ("m1", "m2", "m3"):
+        config_dict["modules"][name]["walk"].append("1.3.6.1.2.1.2")
+    state = dataclasses.replace(
+        state, config={**state.config, "config_file": yaml.dump(config_dict)}
+    )
+    ctx.run(ctx.on.config_changed(), state=state)
+
+    assert "SNMP config: 1 auth rotated, 3 modules changed; reload needed" in caplog.messages
+
+
+def test_failed_reload_falls_back_to_restart(ctx, exporter_snap, exporter_reload):
+    """Test that the service is restarted when the exporter cannot be reloaded."""
+    config_dict = {"modules": {"m1": {"walk": ["1.3.6.1.2.1.1"]}}}
+    state = State(
+        config={
+            "config_file": yaml.dump(config_dict),
+            "scrape_config_file": yaml.dump({"scrape_configs": []}),
+            "config_apply_delay": 0,
+        }
+    )
+    state = ctx.run(ctx.on.config_changed(), state=state)
+    exporter_snap.restart.reset_mock()
+
+    exporter_reload.side_effect = urllib.error.URLError("connection refused")
+    config_dict["modules"]["m1"]["walk"].append("1.3.6.1.2.1.2")
+    state = dataclasses.replace(
+        state, config={**state.config, "config_file": yaml.dump(config_dict)}
+    )
+    ctx.run(ctx.on.config_changed(), state=state)
+
+    exporter_reload.assert_called_once()
+    exporter_snap.restart.assert_called_once()
+
+
+def test_config_changes_are_applied_once_settled(ctx, config_dir, exporter_snap, exporter_reload):
+    """Test that a burst of config changes is applied with a single reload, once settled."""
+    config_dict = {"modules": {"m1": {"walk": ["1.3.6.1.2.1.1"]}}}
+    state = State(
+        config={
+            "config_file": yaml.dump(config_dict),
+            "scrape_config_file": yaml.dump({"scrape_configs": []}),
+            "config_apply_delay": 60,
+        }
+    )
+    with mock.patch("time.time", return_value=1000.0) as now:
+        # The first config is applied right away
+        state = ctx.run(ctx.on.config_changed(), state=state)
+        exporter_snap.restart.assert_called_once()
+        exporter_snap.restart.reset_mock()
+
+        # A burst of changes is only staged
+        for oid in ("1.3.6.1.2.1.2", "1.3.6.1.2.1.31", "1.3.6.1.2.1.4"):
+            now.return_value += 10
+            config_dict["modules"]["m1"]["walk"].append(oid)
+            state = dataclasses.replace(
+                state, config={**state.config, "config_file": yaml.dump(config_dict)}
+            )
+            state = ctx.run(ctx.on.config_changed(), state=state)
+        assert "1.3.6.1.2.1.4" not in (config_dir / "modules-m1.yml").read_text()
+        assert state.unit_status.message.startswith("Config change pending")
+
+        # Not applied until the config has been quiet for the whole delay
+        now.return_value += 59
+        state = ctx.run(ctx.on.update_status(), state=state)
+        exporter_reload.assert_not_called()
+
+        now.return_value += 1
+        state = ctx.run(ctx.on.update_status(), state=state)
+        assert "1.3.6.1.2.1.4" in (config_dir / "modules-m1.yml").read_text()
+        exporter_reload.assert_called_once()
+        exporter_snap.restart.assert_not_called()
+        assert state.unit_status == ActiveStatus()
+
+        # Nothing left to apply
+        state = ctx.run(ctx.on.update_status(), state=state)
+        exporter_reload.assert_called_once()
+
+
+def test_upgrade_removes_the_legacy_config_file(ctx, config_dir, exporter_snap, tmp_path):
+    """Test that the config file of older charm revisions is removed once CONFIG_DIR is used."""
+    legacy_config = tmp_path / "snmp.yml"
+    legacy_config.write_text(yaml.dump({"modules": {"old": {"walk": ["1.3.6.1.2.1.1"]}}}))
+    config_dict = {"modules": {"m1": {"walk": ["1.3.6.1.2.1.1"]}}}
+    resource = tmp_path / "prometheus-snmp-exporter.snap"
+    resource.touch()
+    state = State(
+        config={
+            "config_file": yaml.dump(config_dict),
+            "scrape_config_file": yaml.dump({"scrape_configs": []}),
+        },
+        resources={Resource(name="snap", path=resource)},
+    )
+
+    state = ctx.run(ctx.on.upgrade_charm(), state=state)
+    state = ctx.run(ctx.on.config_changed(), state=state)
+
+    assert not legacy_config.exists()
+    assert (config_dir / "modules-m1.yml").exists()
+    exporter_snap.restart.assert_called_once()
+
+
+def test_unrelated_config_changes_keep_the_pending_change_settling(
+    ctx, config_dir, exporter_reload
+):
+    """Test that config-changed without a new SNMP config does not delay the pending one."""
+    config_dict = {"modules": {"m1": {"walk": ["1.3.6.1.2.1.1"]}}}
+    state = State(
+        config={
+            "config_file": yaml.dump(config_dict),
+            "scrape_config_file": yaml.dump({"scrape_configs": []}),
+            "config_apply_delay": 60,
+        }
+    )
+    with mock.patch("time.time", return_value=1000.0) as now:
+        state = ctx.run(ctx.on.config_changed(), state=state)
+        config_dict["modules"]["m1"]["walk"].append("1.3.6.1.2.1.2")
+        state = dataclasses.replace(
+            state, config={**state.config, "config_file": yaml.dump(config_dict)}
+        )
+        state = ctx.run(ctx.on.config_changed(), state=state)
+
+        now.return_value += 50
+        state = dataclasses.replace(state, config={**state.config, "targets": "1.2.3.4"})
+        state = ctx.run(ctx.on.config_changed(), state=state)
+
+        now.return_value += 10
+        state = ctx.run(ctx.on.update_status(), state=state)
+        assert "1.3.6.1.2.1.2" in (config_dir / "modules-m1.yml").read_text()
+        exporter_reload.assert_called_once()
+
+
+@pytest.mark.parametrize("config_file", ["modules: [unclosed", ""])
+def test_pending_config_is_dropped_when_replaced(ctx, config_dir, exporter_reload, config_file):
+    """Test that a staged config is not applied once config_file is made invalid or unset."""
+    config_dict = {"modules": {"m1": {"walk": ["1.3.6.1.2.1.1"]}}}
+    state = State(
+        config={
+            "config_file": yaml.dump(config_dict),
+            "scrape_config_file": yaml.dump({"scrape_configs": []}),
+            "config_apply_delay": 60,
+        }
+    )
+    with mock.patch("time.time", return_value=1000.0) as now:
+        state = ctx.run(ctx.on.config_changed(), state=state)
+        config_dict["modules"]["m1"]["walk"].append("1.3.6.1.2.1.2")
+        state = dataclasses.replace(
+            state, config={**state.config, "config_file": yaml.dump(config_dict)}
+        )
+        state = ctx.run(ctx.on.config_changed(), state=state)
+
+        state = dataclasses.replace(state, config={**state.config, "config_file": config_file})
+        state = ctx.run(ctx.on.config_changed(), state=state)
+
+        now.return_value += 60
+        state = ctx.run(ctx.on.update_status(), state=state)
+        assert "1.3.6.1.2.1.2" not in (config_dir / "modules-m1.yml").read_text()
+        exporter_reload.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "prefix, compress", [("gz:", gzip.compress), ("xz:", lzma.compress)]
+)
+def test_compressed_config_files(ctx, config_dir, prefix, compress):
+    """Test that config files can be sent compressed."""
+    config_dict = {
+        "auths": {"public_v2": {"community": "public", "version": 2}},
+        "modules": {"my_module": {"walk": ["1.3.6.1.2.1.1"]}},
+    }
+    scrape_config_dict = {
+        "scrape_configs": [
+            {"job_name": "snmp", "static_configs": [{"targets": ["1.2.3.4"]}]},
+        ]
+    }
+
+    def encode(content: dict) -> str:
+        return prefix + base64.b64encode(compress(yaml.dump(content).encode())).decode()
+
+    cos_agent_relation = Relation("cos-agent", remote_app_name="grafana-agent")
+    state = State(
+        relations=[cos_agent_relation],
+        config={
+            "config_file": encode(config_dict),
+            "scrape_config_file": encode(scrape_config_dict),
+        },
+    )
+    state_out = ctx.run(ctx.on.config_changed(), state=state)
+
+    assert state_out.unit_status.name == "active"
+    assert yaml.safe_load((config_dir / "modules-my_module.yml").read_text()) == {
+        "modules": config_dict["modules"]
+    }
+    relation_data = json.loads(next(iter(state_out.relations)).local_unit_data["config"])
+    assert relation_data["metrics_scrape_jobs"][0]["static_configs"][0]["targets"] == ["1.2.3.4"]
+
+
+@pytest.mark.parametrize(
+    "prefix, compress", [("gz:", gzip.compress), ("xz:", lzma.compress)]
+)
+def test_concatenated_compressed_config_file(ctx, config_dir, prefix, compress):
+    """Test that a config_file compressed as several streams is decompressed in full."""
+    content = yaml.dump({"modules": {f"m{i}": {"walk": ["1.3.6.1.2.1.1"]} for i in range(3)}})
+    streams = b"".join(compress(part.encode()) for part in (content[:20], content[20:], ""))
+    state = State(
+        config={
+            "config_file": prefix + base64.b64encode(streams).decode(),
+            "scrape_config_file": yaml.dump({"scrape_configs": []}),
+        }
+    )
+    state_out = ctx.run(ctx.on.config_changed(), state=state)
+
+    assert state_out.unit_status.name == "active"
+    assert sorted(path.name for path in config_dir.iterdir()) == [
+        "modules-m0.yml",
+        "modules-m1.yml",
+        "modules-m2.yml",
+    ]
+
+    garbled = prefix + base64.b64encode(streams + b"trailing garbage").decode()
+    state = dataclasses.replace(state, config={**state.config, "config_file": garbled})
+    state_out = ctx.run(ctx.on.config_changed(), state=state)
+    assert state_out.unit_status.name == "blocked"
+
+
+def test_invalid_compressed_config_file(ctx, config_dir):
+    """Test that a corrupt compressed config_file results in blocked status."""
+    state = State(
+        config={
+            "config_file": "gz:" + base64.b64encode(b"not gzip").decode(),
+            "scrape_config_file": yaml.dump({"scrape_configs": []}),
+        }
+    )
+    state_out = ctx.run(ctx.on.config_changed(), state=state)
+    assert state_out.unit_status.name == "blocked"
+    assert not config_dir.exists()
+
+
+def test_invalid_config_is_not_swapped_in(ctx, config_dir, exporter_snap, subprocess_run):
+    """Test that a config rejected by the exporter's dry-run keeps the known-good config."""
+    config_dict = {"modules": {"m1": {"walk": ["1.3.6.1.2.1.1"]}}}
+    good_config: dict[str, str | int | float | bool] = {
+        "config_file": yaml.dump(config_dict),
+        "scrape_config_file": yaml.dump({"scrape_configs": []}),
+    }
+    state = ctx.run(ctx.on.config_changed(), state=State(config=good_config))
+    assert state.unit_status.name == "active"
+    good_files = {path.name: path.read_text() for path in config_dir.iterdir()}
+    exporter_snap.restart.reset_mock()
+
+    def dry_run(args, **kwargs):
+        if "--dry-run" in args:
+            raise subprocess.CalledProcessError(
+                1, args, stderr='level=error msg="Error parsing config file" err="unknown oid"\n'
+            )
+
+    subprocess_run.side_effect = dry_run
+    config_dict["modules"]["m1"]["walk"] = ["not-an-oid"]
+    state = dataclasses.replace(
+        state, config={**good_config, "config_file": yaml.dump(config_dict)}
+    )
+    state = ctx.run(ctx.on.config_changed(), state=state)
+
+    assert state.unit_status == BlockedStatus(
+        'Invalid configuration file: level=error msg="Error parsing config file" err="unknown oid"'
+    )
+    assert {path.name: path.read_text() for path in config_dir.iterdir()} == good_files
+    exporter_snap.restart.assert_not_called()
+
+    # The rejected config stays blocked, without validating it again
+    subprocess_run.reset_mock()
+    state = ctx.run(ctx.on.update_status(), state=state)
+    state = ctx.run(ctx.on.config_changed(), state=state)
+    assert state.unit_status.name == "blocked"
+    assert not [c for c in subprocess_run.call_args_list if "--dry-run" in c.args[0]]
+
+
+def test_config_validation_is_cached(ctx, subprocess_run):
+    """Test that the same config is only validated by the exporter once."""
+    state = State(
+        config={
+            "config_file": yaml.dump({"modules": {"m1": {"walk": ["1.3.6.1.2.1.1"]}}}),
+            "scrape_config_file": yaml.dump({"scrape_configs": []}),
+        }
+    )
+    for _ in range(3):
+        state = ctx.run(ctx.on.config_changed(), state=state)
+
+    dry_runs = [c for c in subprocess_run.call_args_list if "--dry-run" in c.args[0]]
+    assert len(dry_runs) == 1
+
+
+def test_snap_state_is_saved_for_the_next_hook(ctx, snap_cache):
+    """Test that the charm persists what it learnt about its snap at the end of each hook."""
+    ctx.run(ctx.on.update_status(), State())
+
+    assert snap_cache.call_args.kwargs["state_file"].name == ".snap_state.json"
+    snap_cache.return_value.save_state.assert_called_once()
+
+
+def test_find_walk_timeouts(ctx, exporter_snap):
+    """Test that the action returns the most recent log lines of walks that timed out."""
+    timeout = 'msg="Error scraping target" err="error walking target {}: request timeout"'
+    exporter_snap.iter_logs.return_value = iter(
+        [
+            {"timestamp": f"t{i}", "message": timeout.format(f"10.0.0.{i}") if i % 3 else "ok"}
+            for i in range(10)
+        ]
+    )
+
+    ctx.run(ctx.on.action("find-walk-timeouts", params={"lines": 1000, "limit": 2}), State())
+
+    exporter_snap.iter_logs.assert_called_once_with(["snmp-exporter"], num_lines=1000)
+    assert ctx.action_results == {
+        "found": 6,
+        "timeouts": "\n".join(f"t{i} {timeout.format(f'10.0.0.{i}')}" for i in (7, 8)),
+    }
+
+
+def test_install_prefers_the_snap_resource(ctx, exporter_snap, tmp_path):
+    """Test that an attached snap resource is sideloaded instead of installing from the store."""
+    resource = tmp_path / "prometheus-snmp-exporter.snap"
+    resource.write_bytes(b"hsqs")
+    with mock.patch.object(snapd, "install_local") as install_local:
+        ctx.run(ctx.on.install(), State(resources={Resource(name="snap", path=resource)}))
+
+    install_local.assert_called_once_with(str(resource), dangerous=True)
+    exporter_snap.ensure.assert_not_called()
+
+
+def test_upgrade_sideloads_a_new_snap_resource(ctx, exporter_snap, tmp_path):
+    """Test that upgrade-charm sideloads the snap resource only if it changed."""
+    resource = tmp_path / "prometheus-snmp-exporter.snap"
+    resource.write_bytes(b"hsqs")
+    state = State(resources={Resource(name="snap", path=resource)})
+    with mock.patch.object(snapd, "install_local") as install_local:
+        state = ctx.run(ctx.on.install(), state)
+        state = ctx.run(ctx.on.upgrade_charm(), state)
+        install_local.assert_called_once()
+
+        resource.write_bytes(b"hsqs, rebuilt")
+        state = ctx.run(ctx.on.upgrade_charm(), state)
+        assert install_local.call_count == 2
+        ctx.run(ctx.on.upgrade_charm(), state)
+        assert install_local.call_count == 2
+    exporter_snap.ensure.assert_not_called()
+
+
+def test_upgrade_without_snap_resource_keeps_the_snap(ctx, exporter_snap, tmp_path):
+    """Test that upgrade-charm leaves a snap installed from the store alone."""
+    resource = tmp_path / "prometheus-snmp-exporter.snap"
+    resource.touch()
+    with mock.patch.object(snapd, "install_local") as install_local:
+        ctx.run(ctx.on.upgrade_charm(), State(resources={Resource(name="snap", path=resource)}))
+
+    install_local.assert_not_called()
+    exporter_snap.ensure.assert_not_called()
+
+
+def test_install_from_the_store_without_snap_resource(ctx, exporter_snap, tmp_path):
+    """Test that the snap is installed from the store if the attached resource is empty."""
+    resource = tmp_path / "prometheus-snmp-exporter.snap"
+    resource.touch()
+    with mock.patch.object(snapd, "install_local") as install_local:
+        ctx.run(ctx.on.install(), State(resources={Resource(name="snap", path=resource)}))
+
+    install_local.assert_not_called()
+    exporter_snap.ensure.assert_called_once()
@@ -0,0 +1,345 @@
+import dataclasses
+import json
+import random
+import time
+from typing import List
+from unittest import mock
+
+import ops
+import pytest
+from ops.testing import Context, Relation, State
+
+import cos_agent_provider
+
+PROVIDER_META = {
+    "name": "provider",
+    "provides": {"cos-agent": {"interface": "cos_agent", "limit": 1}},
+}
+
+
+class ProviderCharm(ops.CharmBase):
+    def __init__(self, framework: ops.Framework):
+        super().__init__(framework)
+        self.cos_agent = cos_agent_provider.CachingCOSAgentProvider(
+            self,
+            dashboard_dirs=[str(self.charm_dir / "dashboards")],
+            dashboard_codec=cos_agent_provider.ZlibCodec(),
+        )
+
+
+class ManyTargetsProviderCharm(ops.CharmBase):
+    targets: List[str] = []
+
+    def __init__(self, framework: ops.Framework):
+        super().__init__(framework)
+        self.cos_agent = cos_agent_provider.CachingCOSAgentProvider(
+            self,
+            scrape_configs=lambda: [
+                {"job_name": "snmp", "static_configs": [{"targets": list(self.targets)}]},
+                {"job_name": "self", "static_configs": [{"targets": ["localhost:9116"]}]},
+            ],
+            scrape_jobs_chunk_size=64 * 1024,
+        )
+
+
+def synthetic_dashboard(panels: int, seed: int = 0) -> dict:
+    """Return a dashboard shaped like the SNMP interface dashboards seen in the wild."""
+    rng = random.Random(seed)
+    metrics = ["ifHCInOctets", "ifHCOutOctets", "ifInErrors", "ifOutErrors", "ifInDiscards"]
+    return {
+        "title": f"SNMP interfaces ({panels} panels)",
+        "tags": ["snmp"],
+        "templating": {
+            "list": [
+                {"name": name, "type": "query", "query": f"label_values({name})"}
+                for name in ("juju_model", "juju_application", "instance", "ifName")
+            ]
+        },
+        "panels": [
+            {
+                "id": idx,
+                "title": f"{metric} on port {rng.randint(1, 48)}",
+                "type": "timeseries",
+                "gridPos": {"h": 8, "w": 12, "x": 12 * (idx % 2), "y": 8 * (idx // 2)},
+                "datasource": {"type": "prometheus", "uid": "${prometheusds}"},
+                "fieldConfig": {
+                    "defaults": {"unit": "bps", "custom": {"lineWidth": 1, "fillOpacity": 10}},
+                    "overrides": [],
+                },
+                "targets": [
+                    {
+                        "expr": f'rate({metric}{{juju_model=~"$juju_model",'
+                        f'instance=~"$instance",ifName=~"$ifName"}}[5m]) * 8',
+                        "legendFormat": "{{instance}} {{ifName}}",
+                        "refId": "A",
+                    }
+                ],
+            }
+            for idx, metric in enumerate(rng.choice(metrics) for _ in range(panels))
+        ],
+    }
+
+
+@pytest.fixture
+def provider_ctx(tmp_path):
+    (tmp_path / "dashboards").mkdir()
+    (tmp_path / "dashboards" / "snmp.json").write_text(json.dumps(synthetic_dashboard(10)))
+    return Context(ProviderCharm, meta=PROVIDER_META, charm_root=tmp_path)
+
+
+def test_dashboard_codec_falls_back_to_legacy(provider_ctx):
+    """Test that dashboards are LZMA compressed for requirers not advertising any codec."""
+    relation = Relation("cos-agent", remote_app_name="grafana-agent")
+    state = State(relations=[relation])
+    state = provider_ctx.run(provider_ctx.on.relation_changed(relation), state)
+
+    data = json.loads(state.get_relation(relation.id).local_unit_data["config"])
+    assert data["dashboard_codec"] == cos_agent_provider.LZMACodec.name
+    assert json.loads(cos_agent_provider.LZMACodec().decode(data["dashboards"][0]))["title"]
+
+
+def test_dashboard_codec_is_negotiated(provider_ctx):
+    """Test that the preferred codec is used once the requirer advertises it."""
+    relation = Relation(
+        "cos-agent",
+        remote_app_name="grafana-agent",
+        remote_units_data={
+            0: {
+                "receivers": "[]",
+                "dashboard_codecs": json.dumps(list(cos_agent_provider.DASHBOARD_CODECS)),
+            }
+        },
+    )
+    state = State(relations=[relation])
+    state = provider_ctx.run(provider_ctx.on.relation_changed(relation), state)
+
+    data = json.loads(state.get_relation(relation.id).local_unit_data["config"])
+    assert data["dashboard_codec"] == cos_agent_provider.ZlibCodec.name
+    assert json.loads(cos_agent_provider.ZlibCodec().decode(data["dashboards"][0]))["title"]
+
+
+def test_dashboard_codecs_are_cached_apart(provider_ctx):
+    """Test that relations with different codecs do not evict each other's cached dashboards."""
+    legacy = Relation("cos-agent", remote_app_name="grafana-agent")
+    zlib = Relation(
+        "cos-agent",
+        remote_app_name="grafana-agent",
+        remote_units_data={
+            0: {
+                "receivers": "[]",
+                "dashboard_codecs": json.dumps([cos_agent_provider.ZlibCodec.name]),
+            }
+        },
+    )
+    provider_ctx.run(provider_ctx.on.relation_changed(legacy), State(relations=[legacy, zlib]))
+
+    # Another unit of the charm, sharing nothing but the cache, encodes nothing
+    with (
+        mock.patch.object(cos_agent_provider.LZMACodec, "encode", side_effect=AssertionError),
+        mock.patch.object(cos_agent_provider.ZlibCodec, "encode", side_effect=AssertionError),
+    ):
+        state = provider_ctx.run(
+            provider_ctx.on.relation_changed(legacy), State(relations=[legacy, zlib])
+        )
+    data = json.loads(state.get_relation(zlib.id).local_unit_data["config"])
+    assert data["dashboard_codec"] == cos_agent_provider.ZlibCodec.name
+
+
+def test_alert_rules_are_loaded_once_per_charm_revision(provider_ctx):
+    """Test that the rule files are only loaded again after a charm upgrade."""
+    first = Relation("cos-agent", remote_app_name="grafana-agent")
+    second = Relation("cos-agent", remote_app_name="grafana-agent")
+
+    with mock.patch.object(
+        cos_agent_provider, "AlertRules", wraps=cos_agent_provider.AlertRules
+    ) as alert_rules:
+        state = provider_ctx.run(provider_ctx.on.relation_changed(first), State(relations=[first]))
+        assert alert_rules.call_count == 2  # metrics and logs
+        rules = json.loads(state.get_relation(first.id).local_unit_data["config"])
+
+        # A relation the rules were never written to reuses the rendered rules
+        state = dataclasses.replace(state, relations=[second])
+        state = provider_ctx.run(provider_ctx.on.relation_changed(second), state)
+        assert alert_rules.call_count == 2
+        data = json.loads(state.get_relation(second.id).local_unit_data["config"])
+        assert data["metrics_alert_rules"] == rules["metrics_alert_rules"]
+
+        state = provider_ctx.run(provider_ctx.on.upgrade_charm(), state)
+        second = state.get_relation(second.id)
+        state = provider_ctx.run(provider_ctx.on.relation_changed(second), state)
+        assert alert_rules.call_count == 4
+
+
+def targets_by_job(jobs: List[dict]) -> dict:
+    return {
+        job["job_name"]: [t for sc in job.get("static_configs", []) for t in sc["targets"]]
+        for job in jobs
+    }
+
+
+def test_scrape_jobs_are_chunked_and_reassembled():
+    """Test that large scrape jobs round-trip through size-bounded chunks."""
+    jobs = [
+        {
+            "job_name": "snmp",
+            "metrics_path": "/snmp",
+            "static_configs": [
+                {"targets": [f"10.0.{i // 256}.{i % 256}" for i in range(20000)]},
+                {"targets": ["192.168.0.1"], "labels": {"site": "lab"}},
+            ],
+        },
+        {"job_name": "exporter", "static_configs": [{"targets": ["localhost:9116"]}]},
+    ]
+    chunk_size = 16 * 1024
+
+    chunks = cos_agent_provider.chunk_scrape_jobs(jobs, chunk_size)
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= chunk_size for chunk in chunks)
+    databag = {
+        cos_agent_provider.SCRAPE_JOBS_CHUNK_KEY.format(i): chunk for i, chunk in enumerate(chunks)
+    }
+    manifest = [cos_agent_provider._digest(chunk) for chunk in chunks]
+    reassembled = cos_agent_provider.read_scrape_job_chunks(databag, manifest)
+    assert reassembled is not None
+    assert targets_by_job(reassembled) == targets_by_job(jobs)
+    assert reassembled[0]["metrics_path"] == "/snmp"
+    lab = [sc for sc in reassembled[0]["static_configs"] if sc.get("labels")]
+    assert lab == [{"targets": ["192.168.0.1"], "labels": {"site": "lab"}}]
+
+    # A tampered or missing chunk is detected
+    databag[cos_agent_provider.SCRAPE_JOBS_CHUNK_KEY.format(1)] = "[]"
+    assert cos_agent_provider.read_scrape_job_chunks(databag, manifest) is None
+    # Small jobs are not chunked
+    assert cos_agent_provider.chunk_scrape_jobs(jobs[1:], chunk_size) == []
+
+
+def test_only_changed_scrape_job_chunks_are_rewritten(monkeypatch):
+    """Test that the provider publishes large jobs in chunks, and rewrites only changed ones."""
+    ctx = Context(ManyTargetsProviderCharm, meta=PROVIDER_META)
+    monkeypatch.setattr(
+        ManyTargetsProviderCharm, "targets", [f"10.1.{i // 256}.{i % 256}" for i in range(20000)]
+    )
+    relation = Relation(
+        "cos-agent",
+        remote_app_name="grafana-agent",
+        remote_units_data={0: {"receivers": "[]", "scrape_jobs_chunks": "true"}},
+    )
+    state = ctx.run(ctx.on.relation_changed(relation), State(relations=[relation]))
+    first = state.get_relation(relation.id).local_unit_data
+    data = json.loads(first["config"])
+    assert data["metrics_scrape_jobs"] == []
+    chunk_count = len(data["metrics_scrape_jobs_chunks"])
+    assert chunk_count > 1
+
+    # Replace the last target: only the last chunk changes
+    monkeypatch.setattr(
+        ManyTargetsProviderCharm, "targets", [*ManyTargetsProviderCharm.targets[:-1], "10.9.9.9"]
+    )
+    state = ctx.run(ctx.on.config_changed(), state)
+    second = state.get_relation(relation.id).local_unit_data
+    changed = [
+        index
+        for index in range(chunk_count)
+        if first[cos_agent_provider.SCRAPE_JOBS_CHUNK_KEY.format(index)]
+        != second[cos_agent_provider.SCRAPE_JOBS_CHUNK_KEY.format(index)]
+    ]
+    assert changed == [chunk_count - 1]
+
+    # The requirer reassembles the jobs
+    manifest = json.loads(second["config"])["metrics_scrape_jobs_chunks"]
+    jobs = cos_agent_provider.read_scrape_job_chunks(second, manifest)
+    assert jobs is not None
+    targets = targets_by_job(jobs)
+    assert targets["provider_0_snmp"] == ManyTargetsProviderCharm.targets
+    assert targets["provider_1_self"] == ["localhost:9116"]
+
+
+def test_unnamed_scrape_jobs_are_named_by_content():
+    """Test that unnamed jobs get names that do not depend on their position, and round-trip."""
+    unnamed = [
+        {
+            "metrics_path": path,
+            "static_configs": [{"targets": [f"10.4.0.{i}" for i in range(250)]}],
+        }
+        for path in ("/a", "/b")
+    ]
+    named = {"job_name": "exporter", "static_configs": [{"targets": ["localhost:9116"]}]}
+    chunk_size = 1024
+
+    def reassemble(jobs):
+        chunks = cos_agent_provider.chunk_scrape_jobs(jobs, chunk_size)
+        databag = {
+            cos_agent_provider.SCRAPE_JOBS_CHUNK_KEY.format(i): c for i, c in enumerate(chunks)
+        }
+        manifest = [cos_agent_provider._digest(c) for c in chunks]
+        reassembled = cos_agent_provider.read_scrape_job_chunks(databag, manifest)
+        assert reassembled is not None
+        return {job["metrics_path"]: job for job in reassembled if "metrics_path" in job}
+
+    first = reassemble(unnamed)
+    second = reassemble([named, unnamed[1], unnamed[0]])
+
+    assert len({job["job_name"] for job in first.values()}) == 2
+    assert {path: job["job_name"] for path, job in second.items()} == {
+        path: job["job_name"] for path, job in first.items()
+    }
+    assert targets_by_job(list(first.values())) == {
+        job["job_name"]: [f"10.4.0.{i}" for i in range(250)] for job in first.values()
+    }
+
+
+def test_inserting_a_target_only_changes_its_chunk():
+    """Test that chunk boundaries follow content, so a front insert does not shift every chunk."""
+    targets = [f"10.2.{i // 256}.{i % 256}" for i in range(20000)]
+    chunk_size = 16 * 1024
+
+    def chunk(targets):
+        jobs = [{"job_name": "snmp", "static_configs": [{"targets": targets}]}]
+        return cos_agent_provider.chunk_scrape_jobs(jobs, chunk_size)
+
+    before = chunk(targets)
+    after = chunk(["10.3.0.1", *targets])
+
+    assert len(before) > 10
+    assert all(len(c) <= chunk_size for c in after)
+    assert after[1:] == before[1:]
+    assert after[0] != before[0]
+
+
+@pytest.mark.parametrize(
+    "codec",
+    [
+        cos_agent_provider.LZMACodec(),
+        cos_agent_provider.LZMACodec(preset=1),
+        cos_agent_provider.LZMACodec(preset=9),
+        cos_agent_provider.ZlibCodec(),
+        cos_agent_provider.ZlibCodec(level=1),
+        cos_agent_provider.ZlibCodec(level=9),
+    ],
+    ids=repr,
+)
+def test_dashboard_codec_benchmark(codec):
+    """Compare encode time, decode time and databag size of the dashboard codecs.
+
+    Run with `-k benchmark` to compare the codecs; the results are printed.
+    """
+    dashboards = [
+        json.dumps(synthetic_dashboard(panels, seed)) for seed, panels in enumerate((20, 80, 200))
+    ]
+    raw_size = sum(len(d) for d in dashboards)
+
+    start = time.perf_counter()
+    encoded = [codec.encode(d) for d in dashboards]
+    encode_time = time.perf_counter() - start
+    start = time.perf_counter()
+    decoded = [codec.decode(e) for e in encoded]
+    decode_time = time.perf_counter() - start
+    size = sum(len(e) for e in encoded)
+
+    print(
+        f"\n{codec!r}: encode {encode_time * 1000:.1f}ms, decode {decode_time * 1000:.1f}ms, "
+        f"{size} bytes ({size / raw_size:.1%} of {raw_size} bytes)"
+    )
+    assert decoded == dashboards
+    assert size < raw_size
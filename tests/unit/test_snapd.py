@@ -0,0 +1,887 @@
+import http.server
+import json
+import socketserver
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+import snapd
+
+# The response of a route for snapd to close the connection without responding
+HANG_UP = (0, None)
+
+
+class FakeSnapd:
+    """A fake snapd, serving canned JSON responses over a unix socket."""
+
+    class QuietHandler(http.server.BaseHTTPRequestHandler):
+        """A keep-alive request handler that does not log requests."""
+
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        # {"METHOD /v2/path": result or callable(query, body) -> (status code, response)}
+        self.routes: dict[str, Any] = {}
+        self.requests = []
+        self.connections = 0
+        # Close every connection after a response, without telling the client
+        self.drop_connections = False
+
+        fake_snapd = self
+
+        class Handler(FakeSnapd.QuietHandler):
+            def setup(self):
+                super().setup()
+                fake_snapd.connections += 1
+
+            def do_GET(self):  # noqa: N802
+                self.respond()
+
+            do_POST = do_PUT = do_GET  # noqa: N815
+
+            def respond(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                url = urllib.parse.urlsplit(self.path)
+                query = dict(urllib.parse.parse_qsl(url.query))
+                fake_snapd.requests.append((self.command, url.path, query, body))
+                code, response = fake_snapd.handle(self.command, url.path, query, body)
+                if code == HANG_UP[0]:
+                    self.close_connection = True
+                    return
+                data = json.dumps(response).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                if fake_snapd.drop_connections:
+                    self.close_connection = True
+
+        self.server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+        )
+
+    def handle(self, method: str, path: str, query: dict, body: bytes) -> tuple[int, Any]:
+        route = self.routes.get(f"{method} {path}")
+        if route is None:
+            return 404, {"type": "error", "status-code": 404, "result": {"message": "not found"}}
+        if callable(route):
+            return route(query, body)
+        return 200, {"type": "sync", "status-code": 200, "result": route}
+
+
+@pytest.fixture
+def fake_snapd():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fake = FakeSnapd(str(Path(tmp_dir) / "snapd.socket"))
+        fake.thread.start()
+        yield fake
+        fake.server.shutdown()
+        fake.server.server_close()
+        snapd._close_pooled_connection(fake.socket_path)
+        snapd._notices_unsupported.discard(fake.socket_path)
+
+
+def test_requests_reuse_a_keep_alive_connection(fake_snapd):
+    """Benchmark the pooled keep-alive connection against a connection per request."""
+    fake_snapd.routes["GET /v2/snaps"] = [{"name": "prometheus-snmp-exporter"}]
+    requests = 200
+
+    pooled = snapd.SnapdClient(socket_path=fake_snapd.socket_path)
+    start = time.perf_counter()
+    for _ in range(requests):
+        assert pooled.get_installed_snaps() == [{"name": "prometheus-snmp-exporter"}]
+    pooled_time = time.perf_counter() - start
+    assert fake_snapd.connections == 1
+
+    unpooled = snapd.SnapdClient(
+        socket_path=fake_snapd.socket_path,
+        opener=snapd.SnapdClient._get_default_opener(fake_snapd.socket_path),
+    )
+    start = time.perf_counter()
+    for _ in range(requests):
+        unpooled.get_installed_snaps()
+    unpooled_time = time.perf_counter() - start
+    assert fake_snapd.connections == 1 + requests
+
+    print(
+        f"\n{requests} requests: {pooled_time * 1000:.1f}ms pooled, "
+        f"{unpooled_time * 1000:.1f}ms with a connection per request"
+    )
+
+
+def test_closed_connection_is_reopened(fake_snapd):
+    """Test that a connection closed by snapd while idle is transparently replaced."""
+    fake_snapd.routes["GET /v2/snaps"] = []
+    fake_snapd.drop_connections = True
+    client = snapd.SnapdClient(socket_path=fake_snapd.socket_path)
+
+    for _ in range(3):
+        assert client.get_installed_snaps() == []
+    assert fake_snapd.connections == 3
+
+
+def test_only_reads_are_retried_after_a_hang_up(fake_snapd):
+    """Test that a request snapd may have acted on before hanging up is only retried if a GET."""
+    fake_snapd.routes["GET /v2/snaps"] = []
+    client = snapd.SnapdClient(socket_path=fake_snapd.socket_path)
+    client.get_installed_snaps()
+
+    hang_ups = iter([HANG_UP])
+    fake_snapd.routes["GET /v2/snaps"] = lambda query, body: next(
+        hang_ups, (200, {"type": "sync", "result": []})
+    )
+    assert client.get_installed_snaps() == []
+    fake_snapd.routes["PUT /v2/snaps/prometheus-snmp-exporter/conf"] = lambda query, body: HANG_UP
+    with pytest.raises(snapd.SnapAPIError):
+        client._put_snap_conf("prometheus-snmp-exporter", {"port": "9117"})
+
+    requests = [(method, path) for method, path, _, _ in fake_snapd.requests]
+    assert requests == [("GET", "/v2/snaps")] * 3 + [
+        ("PUT", "/v2/snaps/prometheus-snmp-exporter/conf")
+    ]
+
+
+def test_api_errors_are_raised(fake_snapd):
+    """Test that snapd errors are raised as SnapAPIError, and keep the connection usable."""
+    fake_snapd.routes["GET /v2/snaps"] = []
+    client = snapd.SnapdClient(socket_path=fake_snapd.socket_path)
+
+    with pytest.raises(snapd.SnapAPIError) as e:
+        client.get_installed_snap_apps("missing")
+    assert e.value.code == 404
+    assert e.value.body == {"message": "not found"}
+    assert client.get_installed_snaps() == []
+    assert fake_snapd.connections == 1
+
+
+def test_unreachable_snapd_raises(tmp_path):
+    """Test that a missing snapd socket is raised as SnapAPIError."""
+    client = snapd.SnapdClient(socket_path=str(tmp_path / "missing.socket"))
+    with pytest.raises(snapd.SnapAPIError):
+        client.get_installed_snaps()
+
+
+def async_change(change_id: str):
+    """Return a route answering with an async change, as snapd does for snap operations."""
+    return lambda query, body: (
+        202,
+        {"type": "async", "status-code": 202, "status": "Accepted", "change": change_id},
+    )
+
+
+@pytest.fixture
+def exporter_snap(fake_snapd, monkeypatch):
+    """An installed snap talking to the fake snapd, with the snap CLI out of reach."""
+
+    def no_subprocess(*args, **kwargs):
+        raise AssertionError(f"unexpected subprocess: {args}")
+
+    monkeypatch.setattr(subprocess, "run", no_subprocess)
+    monkeypatch.setattr(subprocess, "check_output", no_subprocess)
+    fake_snapd.routes["GET /v2/apps"] = []
+    fake_snapd.routes["GET /v2/changes/1"] = {"id": "1", "kind": "test", "status": "Done"}
+    exporter = snapd.Snap("prometheus-snmp-exporter", snapd.SnapState.Latest, "stable", "1", "")
+    exporter._client = snapd.SnapdClient(socket_path=fake_snapd.socket_path)
+    return exporter
+
+
+def posted(fake_snapd, path: str):
+    """Return the JSON bodies POSTed to `path`."""
+    return [
+        json.loads(body)
+        for method, p, _, body in fake_snapd.requests
+        if (method, p) == ("POST", path)
+    ]
+
+
+def test_install_awaits_the_snapd_change(fake_snapd, exporter_snap):
+    """Test that installing a snap POSTs to snapd and waits until the change is done."""
+    statuses = iter(["Do", "Doing", "Done"])
+    fake_snapd.routes["POST /v2/snaps/prometheus-snmp-exporter"] = async_change("1")
+    fake_snapd.routes["GET /v2/changes/1"] = lambda query, body: (
+        200,
+        {"type": "sync", "result": {"id": "1", "status": next(statuses)}},
+    )
+    exporter_snap._state = snapd.SnapState.Available
+
+    exporter_snap.ensure(snapd.SnapState.Latest, classic=True, channel="latest/edge")
+
+    assert posted(fake_snapd, "/v2/snaps/prometheus-snmp-exporter") == [
+        {"action": "install", "classic": True, "channel": "latest/edge"}
+    ]
+    assert next(statuses, None) is None
+    assert exporter_snap.present
+
+
+@pytest.mark.parametrize(
+    "ensure, body",
+    [
+        ({"revision": "42"}, {"action": "refresh", "revision": "42"}),
+        (
+            {"cohort": "abc", "channel": "1/stable"},
+            {"action": "refresh", "channel": "1/stable", "cohort-key": "abc"},
+        ),
+    ],
+)
+def test_refresh(fake_snapd, exporter_snap, ensure, body):
+    """Test that refreshing a snap POSTs the refresh options to snapd."""
+    fake_snapd.routes["POST /v2/snaps/prometheus-snmp-exporter"] = async_change("1")
+    exporter_snap.ensure(snapd.SnapState.Latest, **ensure)
+    assert posted(fake_snapd, "/v2/snaps/prometheus-snmp-exporter") == [body]
+
+
+def test_remove(fake_snapd, exporter_snap):
+    """Test that removing a snap POSTs to snapd."""
+    fake_snapd.routes["POST /v2/snaps/prometheus-snmp-exporter"] = async_change("1")
+    exporter_snap.ensure(snapd.SnapState.Absent)
+    assert posted(fake_snapd, "/v2/snaps/prometheus-snmp-exporter") == [{"action": "remove"}]
+    assert not exporter_snap.present
+
+
+@pytest.mark.parametrize(
+    "call, body",
+    [
+        (lambda s: s.start(enable=True), {"action": "start", "enable": True}),
+        (lambda s: s.start(["snmp-exporter"]), {"action": "start"}),
+        (lambda s: s.stop(disable=True), {"action": "stop", "disable": True}),
+        (lambda s: s.restart(), {"action": "restart"}),
+        (
+            lambda s: s.restart(["snmp-exporter"], reload=True),
+            {"action": "restart", "reload": True},
+        ),
+    ],
+)
+def test_service_actions(fake_snapd, exporter_snap, call, body):
+    """Test that starting, stopping and restarting services POSTs to the snapd apps API."""
+    fake_snapd.routes["POST /v2/apps"] = async_change("1")
+    call(exporter_snap)
+    [request] = posted(fake_snapd, "/v2/apps")
+    names = request.pop("names")
+    assert request == body
+    assert names in (["prometheus-snmp-exporter"], ["prometheus-snmp-exporter.snmp-exporter"])
+
+
+def test_failed_change_raises(fake_snapd, exporter_snap):
+    """Test that a snapd change ending in error is raised as SnapError."""
+    fake_snapd.routes["POST /v2/apps"] = async_change("1")
+    fake_snapd.routes["GET /v2/changes/1"] = {
+        "id": "1",
+        "kind": "start-snap-services",
+        "status": "Error",
+    }
+    with pytest.raises(snapd.SnapError, match="failed with status Error"):
+        exporter_snap.start()
+
+
+def test_rejected_request_raises(fake_snapd, exporter_snap):
+    """Test that a request rejected by snapd is raised as SnapError, with snapd's message."""
+    fake_snapd.routes["POST /v2/snaps/prometheus-snmp-exporter"] = lambda query, body: (
+        400,
+        {"type": "error", "status-code": 400, "result": {"message": "no such channel"}},
+    )
+    with pytest.raises(snapd.SnapError, match="no such channel"):
+        exporter_snap.ensure(snapd.SnapState.Latest, channel="bogus")
+
+
+def test_hold(fake_snapd, exporter_snap):
+    """Test holding and unholding refreshes, and reading back the hold."""
+    fake_snapd.routes["POST /v2/snaps/prometheus-snmp-exporter"] = async_change("1")
+    fake_snapd.routes["GET /v2/snaps/prometheus-snmp-exporter"] = {
+        "name": "prometheus-snmp-exporter"
+    }
+    assert not exporter_snap.held
+
+    exporter_snap.hold()
+    exporter_snap.hold(timedelta(hours=1))
+    exporter_snap.unhold()
+
+    forever, one_hour, unhold = posted(fake_snapd, "/v2/snaps/prometheus-snmp-exporter")
+    assert forever == {"action": "hold", "hold-level": "general", "time": "forever"}
+    assert one_hour.pop("time") > datetime.now(timezone.utc).isoformat()
+    assert one_hour == {"action": "hold", "hold-level": "general"}
+    assert unhold == {"action": "unhold"}
+
+    fake_snapd.routes["GET /v2/snaps/prometheus-snmp-exporter"] = {"hold": "2100-01-01T00:00:00Z"}
+    assert exporter_snap.held
+
+
+@pytest.mark.parametrize(
+    "service, slot, expected",
+    [
+        (None, None, {"snap": "", "slot": ""}),
+        (None, "core", {"snap": "core", "slot": ""}),
+        (None, ":network", {"snap": "", "slot": "network"}),
+        ("core", "network", {"snap": "core", "slot": "network"}),
+    ],
+)
+def test_connect(fake_snapd, exporter_snap, service, slot, expected):
+    """Test that connecting a plug POSTs to the snapd interfaces API."""
+    fake_snapd.routes["POST /v2/interfaces"] = async_change("1")
+    exporter_snap.connect("network", service=service, slot=slot)
+    assert posted(fake_snapd, "/v2/interfaces") == [
+        {
+            "action": "connect",
+            "plugs": [{"snap": "prometheus-snmp-exporter", "plug": "network"}],
+            "slots": [expected],
+        }
+    ]
+
+
+def test_alias(fake_snapd, exporter_snap):
+    """Test that creating an alias POSTs to the snapd aliases API."""
+    fake_snapd.routes["POST /v2/aliases"] = async_change("1")
+    exporter_snap.alias("snmp-exporter")
+    assert posted(fake_snapd, "/v2/aliases") == [
+        {
+            "action": "alias",
+            "snap": "prometheus-snmp-exporter",
+            "app": "snmp-exporter",
+            "alias": "snmp-exporter",
+        }
+    ]
+
+
+class FakeChange:
+    """A snapd change that is done after `duration`, announcing its updates as notices."""
+
+    created, finished = "2026-01-01T00:00:00.5Z", "2026-01-01T00:00:01Z"
+
+    def __init__(self, fake_snapd, duration: float):
+        self.done_at = time.monotonic() + duration
+        fake_snapd.routes["GET /v2/changes/1"] = self.get_change
+        fake_snapd.routes["GET /v2/notices"] = self.get_notices
+
+    @property
+    def done(self) -> bool:
+        return time.monotonic() >= self.done_at
+
+    def get_change(self, query, body):
+        status = "Done" if self.done else "Doing"
+        return 200, {"type": "sync", "result": {"id": "1", "status": status}}
+
+    def get_notices(self, query, body):
+        assert (query["types"], query["keys"]) == ("change-update", "1")
+        if query.get("after", "") < self.created:
+            return 200, {"type": "sync", "result": [self.notice(self.created)]}
+        time.sleep(max(min(self.done_at - time.monotonic(), float(query["timeout"][:-1])), 0))
+        notices = [self.notice(self.finished)] if self.done else []
+        return 200, {"type": "sync", "result": notices}
+
+    def notice(self, timestamp: str):
+        return {"id": "7", "type": "change-update", "key": "1", "last-repeated": timestamp}
+
+
+def test_wait_long_polls_notices(fake_snapd):
+    """Test that a change is awaited through notices, with a handful of requests to snapd."""
+    client = snapd.SnapdClient(socket_path=fake_snapd.socket_path)
+    start = time.perf_counter()
+    FakeChange(fake_snapd, duration=0.5)
+
+    client._wait("1")
+    elapsed = time.perf_counter() - start
+
+    paths = [path for _, path, _, _ in fake_snapd.requests]
+    # The change is checked on start, after catching up on notices, and when it is done
+    assert paths == [
+        "/v2/changes/1",
+        "/v2/notices",
+        "/v2/changes/1",
+        "/v2/notices",
+        "/v2/changes/1",
+    ]
+    assert elapsed >= 0.5
+    print(f"\nchange done in {elapsed * 1000:.0f}ms with {len(paths)} requests to snapd")
+
+
+def test_wait_falls_back_to_backoff(fake_snapd, monkeypatch):
+    """Test that changes are polled with capped exponential backoff when notices are missing."""
+    checks = iter(["Do"] + ["Doing"] * 6 + ["Done", "Doing", "Done"])
+    fake_snapd.routes["GET /v2/changes/1"] = lambda query, body: (
+        200,
+        {"type": "sync", "result": {"id": "1", "status": next(checks)}},
+    )
+    delays = []
+    monkeypatch.setattr(snapd.time, "sleep", delays.append)
+    client = snapd.SnapdClient(socket_path=fake_snapd.socket_path)
+
+    client._wait("1")
+    assert delays == [0.1, 0.2, 0.4, 0.8, 1.0, 1.0, 1.0]
+
+    # snapd is known not to serve notices anymore, so the next wait goes straight to polling
+    client._wait("1")
+    paths = [path for _, path, _, _ in fake_snapd.requests]
+    assert paths.count("/v2/notices") == 1
+
+
+def test_services_are_cached(fake_snapd, exporter_snap, monkeypatch):
+    """Test that services are read from snapd once, until they change or the cache expires."""
+    active = True
+    fake_snapd.routes["GET /v2/apps"] = lambda query, body: (
+        200,
+        {
+            "type": "sync",
+            "result": [
+                {
+                    "snap": "prometheus-snmp-exporter",
+                    "name": "snmp-exporter",
+                    "daemon": "simple",
+                    "enabled": True,
+                    "active": active,
+                }
+            ],
+        },
+    )
+    fake_snapd.routes["POST /v2/apps"] = async_change("1")
+
+    def apps_reads():
+        return sum(
+            path == "/v2/apps" and method == "GET" for method, path, _, _ in fake_snapd.requests
+        )
+
+    for _ in range(10):
+        assert exporter_snap.services["snmp-exporter"]["active"] is True
+        assert exporter_snap.apps[0]["name"] == "snmp-exporter"
+    assert apps_reads() == 1
+
+    active = False
+    exporter_snap.stop()
+    assert exporter_snap.services["snmp-exporter"]["active"] is False
+    assert apps_reads() == 2
+
+    active = True
+    assert exporter_snap.services["snmp-exporter"]["active"] is False
+    assert exporter_snap.get_services(refresh=True)["snmp-exporter"]["active"] is True
+    assert apps_reads() == 3
+
+    monkeypatch.setattr(snapd, "APPS_CACHE_TTL", 0)
+    assert exporter_snap.services
+    assert apps_reads() == 4
+
+
+@pytest.fixture
+def snap_cache(fake_snapd, tmp_path, monkeypatch):
+    """A SnapCache talking to the fake snapd, with a store catalog of 200k snaps on disk."""
+
+    class SnapdClient(snapd.SnapdClient):
+        def __init__(self, socket_path=fake_snapd.socket_path, **kwargs):
+            super().__init__(socket_path, **kwargs)
+
+    monkeypatch.setattr(snapd, "SnapdClient", SnapdClient)
+    names = tmp_path / "names"
+    names.write_text("".join(f"snap-{i:06d}\n" for i in range(200_000)))
+    monkeypatch.setattr(snapd, "_SNAP_NAMES_PATH", str(names))
+    monkeypatch.setattr(snapd.SnapCache, "snapd_installed", True)
+    fake_snapd.routes["GET /v2/snaps/prometheus-snmp-exporter"] = {
+        "name": "prometheus-snmp-exporter",
+        "channel": "latest/stable",
+        "revision": "42",
+        "confinement": "strict",
+    }
+    fake_snapd.routes["GET /v2/snaps"] = [
+        fake_snapd.routes["GET /v2/snaps/prometheus-snmp-exporter"]
+    ]
+    return snapd.SnapCache()
+
+
+def test_snap_cache_resolves_snaps_on_demand(fake_snapd, snap_cache):
+    """Test that the cache looks up only the snaps it is asked about."""
+    assert fake_snapd.requests == []
+
+    exporter = snap_cache["prometheus-snmp-exporter"]
+    assert (exporter.state, exporter.revision) == (snapd.SnapState.Latest, "42")
+    assert snap_cache["prometheus-snmp-exporter"] is exporter
+    assert [path for _, path, _, _ in fake_snapd.requests] == [
+        "/v2/snaps/prometheus-snmp-exporter"
+    ]
+
+    assert "prometheus-snmp-exporter" in snap_cache
+    for name in ("snap-000000", "snap-123456", "snap-199999"):
+        assert name in snap_cache
+    for name in ("snap-200000", "snap-12345", "nap-000000"):
+        assert name not in snap_cache
+
+    with pytest.raises(snapd.SnapNotFoundError):
+        snap_cache["missing"]
+
+
+def test_snap_cache_raises_snapd_failures(fake_snapd, snap_cache):
+    """Test that a snapd failure is raised, instead of taken as the snap not being installed."""
+    fake_snapd.routes["GET /v2/snaps/prometheus-snmp-exporter"] = lambda query, body: (
+        500,
+        {"type": "error", "status-code": 500, "result": {"message": "snapd is restarting"}},
+    )
+
+    with pytest.raises(snapd.SnapAPIError) as e:
+        snap_cache["prometheus-snmp-exporter"]
+    assert e.value.code == 500
+    with pytest.raises(snapd.SnapAPIError):
+        assert "prometheus-snmp-exporter" in snap_cache
+    assert "/v2/find" not in [path for _, path, _, _ in fake_snapd.requests]
+
+
+def test_snap_cache_memory_is_flat(snap_cache):
+    """Test that looking up names never loads the store catalog into memory."""
+    tracemalloc.start()
+    try:
+        assert "snap-199999" in snap_cache
+        assert "missing" not in snap_cache
+        assert len(snap_cache) == 200_001
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 256 * 1024
+
+
+@pytest.mark.usefixtures("snap_cache")
+def test_snap_state_is_reused_across_hooks(fake_snapd, tmp_path):
+    """Test that saved snap state is revalidated with one request, and dropped on changes."""
+    notices = []
+    fake_snapd.routes["GET /v2/notices"] = lambda query, body: (
+        200,
+        {"type": "sync", "result": [n for n in notices if n["last-repeated"] > query["after"]]},
+    )
+    fake_snapd.routes["GET /v2/apps"] = [{"name": "snmp-exporter", "daemon": "simple"}]
+    state_file = tmp_path / "snap-state.json"
+
+    def hook():
+        cache = snapd.SnapCache(state_file=state_file)
+        assert "snmp-exporter" in cache["prometheus-snmp-exporter"].services
+        cache.save_state()
+        requests = [path for _, path, _, _ in fake_snapd.requests]
+        fake_snapd.requests.clear()
+        return requests
+
+    assert hook() == ["/v2/snaps/prometheus-snmp-exporter", "/v2/apps"]
+    assert hook() == ["/v2/notices"]
+    assert hook() == ["/v2/notices"]
+
+    notices.append({"type": "change-update", "key": "9", "last-repeated": "9999-01-01T00:00:00Z"})
+    assert hook() == ["/v2/notices", "/v2/snaps/prometheus-snmp-exporter", "/v2/apps"]
+
+
+@pytest.mark.usefixtures("snap_cache")
+def test_expired_snap_state_is_reloaded(fake_snapd, tmp_path):
+    """Test that saved snap state is not reused when expired, nor by snapd without notices."""
+    state_file = tmp_path / "snap-state.json"
+    cache = snapd.SnapCache(state_file=state_file)
+    assert cache["prometheus-snmp-exporter"].present
+    cache.save_state()
+    fake_snapd.routes["GET /v2/notices"] = []
+
+    assert snapd.SnapCache(state_file=state_file)._snaps.keys() == {"prometheus-snmp-exporter"}
+    assert snapd.SnapCache(state_file=state_file, state_max_age=0)._snaps == {}
+
+    del fake_snapd.routes["GET /v2/notices"]
+    assert snapd.SnapCache(state_file=state_file)._snaps == {}
+
+
+@pytest.fixture
+def snaps(fake_snapd, snap_cache, monkeypatch):
+    """Installed and available snaps, for the module functions to operate on."""
+    monkeypatch.setattr(snapd, "_cache", snap_cache)
+    for name in ("installed-1", "installed-2"):
+        fake_snapd.routes[f"GET /v2/snaps/{name}"] = {
+            "name": name,
+            "channel": "latest/stable",
+            "revision": "1",
+            "confinement": "strict",
+        }
+    fake_snapd.routes["GET /v2/find"] = lambda query, body: (
+        200,
+        {
+            "type": "sync",
+            "result": [
+                {
+                    "name": query["name"],
+                    "channel": "stable",
+                    "revision": "2",
+                    "confinement": "strict",
+                }
+            ],
+        },
+    )
+    fake_snapd.routes["GET /v2/apps"] = []
+    fake_snapd.routes["GET /v2/changes/1"] = {"id": "1", "status": "Done"}
+    return fake_snapd
+
+
+def test_add_batches_snaps_in_one_transaction(snaps):
+    """Test that adding several snaps is one snapd change per action, instead of one per snap."""
+    snaps.routes["POST /v2/snaps"] = async_change("1")
+
+    added = snapd.add(["available-1", "installed-1", "available-2", "installed-2"])
+
+    assert isinstance(added, list)
+    assert [s.name for s in added] == ["available-1", "installed-1", "available-2", "installed-2"]
+    assert all(s.state is snapd.SnapState.Latest for s in added)
+    assert posted(snaps, "/v2/snaps") == [
+        {"action": "install", "snaps": ["available-1", "available-2"], "transaction": "all-snaps"},
+        {"action": "refresh", "snaps": ["installed-1", "installed-2"], "transaction": "all-snaps"},
+    ]
+    assert [path for _, path, _, _ in snaps.requests].count("/v2/changes/1") == 2
+
+
+def test_remove_batches_snaps(snaps):
+    """Test that removing several snaps is a single snapd change, skipping absent snaps."""
+    snaps.routes["POST /v2/snaps"] = async_change("1")
+
+    removed = snapd.remove(["installed-1", "available-1", "installed-2"])
+
+    assert isinstance(removed, list)
+    assert all(s.state is snapd.SnapState.Absent for s in removed)
+    assert posted(snaps, "/v2/snaps") == [
+        {"action": "remove", "snaps": ["installed-1", "installed-2"]}
+    ]
+
+
+def test_add_with_options_is_not_batched(snaps):
+    """Test that snaps with a channel are added one by one, as snapd refuses multi-snap options."""
+    for name in ("installed-1", "installed-2"):
+        snaps.routes[f"POST /v2/snaps/{name}"] = async_change("1")
+
+    snapd.add(["installed-1", "installed-2"], channel="edge")
+
+    assert posted(snaps, "/v2/snaps") == []
+    assert posted(snaps, "/v2/snaps/installed-1") == [{"action": "refresh", "channel": "edge"}]
+    assert posted(snaps, "/v2/snaps/installed-2") == [{"action": "refresh", "channel": "edge"}]
+
+
+def test_refused_batch_falls_back_to_one_by_one(snaps):
+    """Test that snaps are added one by one when snapd refuses the multi-snap operation."""
+    snaps.routes["POST /v2/snaps"] = lambda query, body: (
+        400,
+        {"type": "error", "result": {"message": "unsupported multi-snap operation"}},
+    )
+    for name in ("installed-1", "installed-2"):
+        snaps.routes[f"POST /v2/snaps/{name}"] = async_change("1")
+
+    snapd.add(["installed-1", "installed-2"])
+
+    assert posted(snaps, "/v2/snaps/installed-1") == [{"action": "refresh", "channel": "latest"}]
+    assert posted(snaps, "/v2/snaps/installed-2") == [{"action": "refresh", "channel": "latest"}]
+
+
+def test_failed_batch_raises(snaps):
+    """Test that a failed multi-snap change is raised, naming the snaps it was for."""
+    snaps.routes["POST /v2/snaps"] = async_change("1")
+    snaps.routes["GET /v2/changes/1"] = {"id": "1", "kind": "install-snap", "status": "Error"}
+
+    with pytest.raises(snapd.SnapError, match="available-1, available-2"):
+        snapd.add(["available-1", "available-2"])
+
+
+def test_config_transaction_applies_changes_at_once(fake_snapd, exporter_snap):
+    """Test that config changes in a transaction run the configure hook once, with one PUT."""
+    fake_snapd.routes["PUT /v2/snaps/prometheus-snmp-exporter/conf"] = async_change("1")
+
+    with exporter_snap.config_transaction():
+        exporter_snap.set({"log.level": "debug", "port": 9116})
+        with exporter_snap.config_transaction():
+            exporter_snap.set({"timeout": 5}, typed=True)
+        exporter_snap.unset("web.listen")
+        assert posted(fake_snapd, "/v2/snaps/prometheus-snmp-exporter/conf") == []
+
+    puts = [json.loads(body) for method, _, _, body in fake_snapd.requests if method == "PUT"]
+    assert puts == [{"log.level": "debug", "port": "9116", "timeout": 5, "web.listen": None}]
+
+    with pytest.raises(RuntimeError), exporter_snap.config_transaction():
+        exporter_snap.set({"port": 9117})
+        raise RuntimeError
+    assert len([method for method, _, _, _ in fake_snapd.requests if method == "PUT"]) == 1
+
+
+def test_config_reads_are_cached(fake_snapd, exporter_snap):
+    """Test that config is read from snapd once, until it is changed."""
+    fake_snapd.routes["GET /v2/snaps/prometheus-snmp-exporter/conf"] = {
+        "log": {"level": "info"},
+        "port": 9116,
+        "debug": False,
+    }
+    fake_snapd.routes["PUT /v2/snaps/prometheus-snmp-exporter/conf"] = async_change("1")
+
+    def conf_reads():
+        return sum(
+            method == "GET" and path.endswith("/conf")
+            for method, path, _, _ in fake_snapd.requests
+        )
+
+    assert exporter_snap.get("log.level") == "info"
+    assert exporter_snap.get("port") == "9116"
+    assert exporter_snap.get("debug") == "false"
+    assert exporter_snap.get("port", typed=True) == 9116
+    assert exporter_snap.get(None, typed=True) == {
+        "log": {"level": "info"},
+        "port": 9116,
+        "debug": False,
+    }
+    exporter_snap.get("log", typed=True)["level"] = "mutated"
+    assert exporter_snap.get("log.level") == "info"
+    with pytest.raises(snapd.SnapError, match="no 'missing' configuration option"):
+        exporter_snap.get("missing")
+    assert conf_reads() == 1
+
+    exporter_snap.set({"port": 9117}, typed=True)
+    exporter_snap.get("port")
+    assert conf_reads() == 2
+
+
+def test_logs_are_streamed(fake_snapd, exporter_snap):
+    """Test that logs are read as a JSON text sequence, on a connection of their own."""
+    records = [
+        {
+            "timestamp": f"2026-01-01T00:00:0{i}Z",
+            "message": f'level={level} msg="line {i}"',
+            "sid": "prometheus-snmp-exporter.snmp-exporter",
+            "pid": "42",
+        }
+        for i, level in enumerate(["info", "warn", "info", "error"])
+    ]
+
+    class LogsHandler(FakeSnapd.QuietHandler):
+        def do_GET(self):  # noqa: N802
+            fake_snapd.requests.append(("GET", self.path, {}, b""))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json-seq")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for record in records:
+                chunk = b"\x1e" + json.dumps(record).encode() + b"\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+
+    fake_snapd.server.RequestHandlerClass = LogsHandler
+    # The pooled connection, were it open, is left alone
+    snapd._pooled_connection(fake_snapd.socket_path, 30)
+
+    assert list(exporter_snap.iter_logs(["snmp-exporter"], num_lines=None)) == records
+    assert [log["message"] for log in exporter_snap.iter_logs(level="WARN")] == [
+        'level=warn msg="line 1"'
+    ]
+    assert exporter_snap.logs(num_lines=4).splitlines()[0] == (
+        '2026-01-01T00:00:00Z prometheus-snmp-exporter.snmp-exporter[42]: level=info msg="line 0"'
+    )
+    paths = [path for _, path, _, _ in fake_snapd.requests]
+    assert paths[0] == "/v2/logs?names=prometheus-snmp-exporter.snmp-exporter&n=-1"
+    assert paths[1:] == ["/v2/logs?names=prometheus-snmp-exporter&n=10"] + [
+        "/v2/logs?names=prometheus-snmp-exporter&n=4"
+    ]
+    assert snapd._connection_pool[fake_snapd.socket_path].sock is None
+
+
+def test_log_errors_are_raised(fake_snapd, exporter_snap):
+    """Test that snapd refusing to stream logs is raised as SnapError."""
+    with pytest.raises(snapd.SnapError, match="not found"):
+        list(exporter_snap.iter_logs(follow=True))
+
+
+@pytest.mark.parametrize(
+    "chunk, end",
+    [
+        pytest.param(b"\x1e{not a log record\n", b"0\r\n\r\n", id="garbage"),
+        pytest.param(b"\x1e[]\n", b"0\r\n\r\n", id="not-a-record"),
+        pytest.param(b'\x1e{"timestamp": "2026-01-01T00:00:00Z"}\n', b"", id="not-a-message"),
+        pytest.param(b'\x1e{"timestamp": "20', b"", id="truncated"),
+    ],
+)
+def test_broken_log_streams_are_raised(fake_snapd, exporter_snap, chunk, end):
+    """Test that a log stream snapd garbles or cuts short is raised as SnapError."""
+
+    class LogsHandler(FakeSnapd.QuietHandler):
+        def do_GET(self):  # noqa: N802
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json-seq")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            size = len(chunk) if end else len(chunk) + 64
+            self.wfile.write(b"%x\r\n%s" % (size, chunk) + (b"\r\n" + end if end else b""))
+            self.close_connection = True
+
+    fake_snapd.server.RequestHandlerClass = LogsHandler
+
+    with pytest.raises(snapd.SnapError, match="Could not read logs"):
+        list(exporter_snap.iter_logs(level="warn"))
+
+
+def test_install_local_streams_the_snap_file(fake_snapd, snap_cache, tmp_path):
+    """Test that a local snap is sideloaded as a multipart upload, streamed from disk."""
+    snap_file = tmp_path / "prometheus-snmp-exporter.snap"
+    size = 16 * 1024 * 1024
+    with snap_file.open("wb") as f:
+        f.truncate(size)
+    uploads = []
+
+    class UploadHandler(FakeSnapd.QuietHandler):
+        def do_POST(self):  # noqa: N802
+            # Keep the start of the form, and discard the snap file as it comes in
+            remaining = int(self.headers["Content-Length"])
+            head = self.rfile.read(1024)
+            remaining -= len(head)
+            while remaining:
+                remaining -= len(self.rfile.read(min(remaining, 64 * 1024)))
+            uploads.append((self.path, self.headers["Content-Type"], head))
+            response = json.dumps({"type": "async", "status-code": 202, "change": "1"}).encode()
+            self.send_response(202)
+            self.send_header("Content-Length", str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def do_GET(self):  # noqa: N802
+            url = urllib.parse.urlsplit(self.path)
+            code, response = fake_snapd.handle("GET", url.path, {}, b"")
+            data = json.dumps(response).encode()
+            self.send_response(code)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    fake_snapd.server.RequestHandlerClass = UploadHandler
+    fake_snapd.routes["GET /v2/changes/1"] = {
+        "id": "1",
+        "status": "Done",
+        "data": {"snap-name": "prometheus-snmp-exporter"},
+    }
+
+    tracemalloc.start()
+    try:
+        installed = snapd.install_local(str(snap_file), dangerous=True)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert installed.name == "prometheus-snmp-exporter"
+    [(path, content_type, head)] = uploads
+    assert path == "/v2/snaps"
+    boundary = content_type.split("boundary=")[1]
+    action = f'--{boundary}\r\nContent-Disposition: form-data; name="action"\r\n\r\ninstall\r\n'
+    assert head.startswith(action.encode())
+    assert b'name="dangerous"\r\n\r\ntrue\r\n' in head
+    assert b'name="snap"; filename="prometheus-snmp-exporter.snap"' in head
+    assert peak < size / 16
+
+
+def test_failed_install_local_raises(fake_snapd, snap_cache, tmp_path):
+    """Test that snapd refusing a local snap is raised as SnapError."""
+    snap_file = tmp_path / "bogus.snap"
+    snap_file.write_bytes(b"not a snap")
+    fake_snapd.routes["POST /v2/snaps"] = lambda query, body: (
+        400,
+        {"type": "error", "result": {"message": "cannot read snap file"}},
+    )
+
+    with pytest.raises(snapd.SnapError, match="cannot read snap file"):
+        snapd.install_local(str(snap_file))